@@ -1,3 +1,5 @@
+import multiprocessing
+
 # Logging
 accesslog = '-'
 errorlog = '-'
@@ -6,5 +8,13 @@ capture_output = True
 # Listening
 bind = ['0.0.0.0:8000']
 
+# Handling
+# The registry keeps its state in memory in the Python process, so we
+# cannot have more than one worker process. Use threads instead, so
+# that requests can be handled concurrently.
+worker_class = 'gthread'
+workers = 1
+threads = multiprocessing.cpu_count() * 2 + 1
+
 # App
 wsgi_app = 'mahiru.rest.registry:wsgi_app()'
@@ -65,8 +65,7 @@ class AssetStore(IAssetStore):
         if asset.id in self._assets:
             raise KeyError(f'There is already an asset with id {asset.id}')
 
-        # TODO: ordering, get file first then insert Asset object
-        self._assets[asset.id] = copy(asset)
+        stored_asset = copy(asset)
         if asset.image_location is not None:
             src_path = Path(asset.image_location)
             tgt_path = self._image_dir / f'{asset.id}.tar.gz'
@@ -74,7 +73,9 @@ class AssetStore(IAssetStore):
                 move(str(src_path), str(tgt_path))
             else:
                 copyfile(src_path, tgt_path)
-            self._assets[asset.id].image_location = str(tgt_path)
+            stored_asset.image_location = str(tgt_path)
+
+        self._assets[asset.id] = stored_asset
 
     def store_image(
             self, asset_id: Identifier, image_file: Path,
@@ -114,10 +115,11 @@ class AssetStore(IAssetStore):
             KeyError: If no asset with the given id is stored here.
 
         """
-        logger.info(f'{self}: servicing request from {requester} for data: '
-                    f'{asset_id}')
+        logger.info(
+                '%s: servicing request from %s for data: %s', self,
+                requester, asset_id)
         self._check_request(asset_id, requester)
-        logger.info(f'{self}: Sending asset {asset_id} to {requester}')
+        logger.info('%s: Sending asset %s to %s', self, asset_id, requester)
         return self._assets[asset_id]
 
     def serve(
@@ -139,8 +141,9 @@ class AssetStore(IAssetStore):
             RuntimeError: If the requester does not have permission to
                     access this asset, or connections are disabled.
         """
-        logger.info(f'{self}: servicing request from {requester} for'
-                    f' connection to {asset_id}')
+        logger.info(
+                '%s: servicing request from %s for connection to %s',
+                self, requester, asset_id)
         self._check_request(asset_id, requester)
         conn_info = self._domain_administrator.serve_asset(
                 self._assets[asset_id], request)
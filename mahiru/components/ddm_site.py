@@ -14,7 +14,7 @@ from mahiru.definitions.assets import Asset
 from mahiru.definitions.identifier import Identifier
 from mahiru.definitions.policy import Rule
 from mahiru.definitions.workflows import Job
-from mahiru.rest.site_client import SiteRestClient
+from mahiru.rest.site_client import get_site_rest_client
 from mahiru.policy.evaluation import PolicyEvaluator
 from mahiru.policy.replication import PolicyStore
 from mahiru.replication import ReplicableArchive
@@ -50,7 +50,7 @@ class Site:
 
         # Create clients for talking to the DDM
         self._registry_client = registry_client
-        self._site_rest_client = SiteRestClient(
+        self._site_rest_client = get_site_rest_client(
                 self.id, self._registry_client, config.trust_store,
                 config.client_creds())
 
@@ -91,6 +91,7 @@ class Site:
     def close(self) -> None:
         """Release resources."""
         self.store.close()
+        self._site_rest_client.close()
 
     def __repr__(self) -> str:
         """Return a string representation of this object."""
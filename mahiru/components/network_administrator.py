@@ -1,5 +1,6 @@
 """Local network management to support step execution."""
 
+from concurrent.futures import as_completed, ThreadPoolExecutor
 import docker
 import logging
 from pathlib import Path
@@ -175,13 +176,21 @@ class WireGuardNA(INetworkAdministrator):
             job_id: Job id of job to disconnect.
             inputs: Input assets for this job, indexed by input name.
         """
-        for name, conn_id in self._active_connections[job_id].items():
-            try:
-                self._site_rest_client.disconnect_asset(
-                        inputs[name].id, conn_id)
-            except Exception as e:
-                logger.warning('Could not disconnect input: {e}')
-                # ignore, we tried our best
+        def disconnect(name: str, conn_id: str) -> None:
+            self._site_rest_client.disconnect_asset(inputs[name].id, conn_id)
+
+        connections = self._active_connections[job_id]
+        if connections:
+            with ThreadPoolExecutor(len(connections)) as pool:
+                futures = [
+                        pool.submit(disconnect, name, conn_id)
+                        for name, conn_id in connections.items()]
+
+                for future in as_completed(futures):
+                    e = future.exception()
+                    if e is not None:
+                        logger.warning('Could not disconnect input: %s', e)
+                        # ignore, we tried our best
 
     def _create_wg_endpoint(
             self, pid: int, net: int, host: int) -> WireGuardEndpoint:
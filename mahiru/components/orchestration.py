@@ -1,14 +1,12 @@
 """Supports running DDM-wide workflows."""
 import logging
-from copy import copy
 from time import sleep
-from typing import Any, Dict, Generator, List
+from typing import Any, Dict, Generator, List, Tuple
 
 from mahiru.components.registry_client import RegistryClient
 from mahiru.definitions.assets import Asset
 from mahiru.definitions.identifier import Identifier
-from mahiru.definitions.workflows import (
-        ExecutionRequest, Job, Plan, Workflow, WorkflowStep)
+from mahiru.definitions.workflows import ExecutionRequest, Job, Plan
 from mahiru.policy.evaluation import (
         PermissionCalculator, Permissions, PolicyEvaluator)
 from mahiru.rest.site_client import SiteRestClient
@@ -17,6 +15,10 @@ from mahiru.rest.site_client import SiteRestClient
 logger = logging.getLogger(__name__)
 
 
+# Workflow output name, site that will have it, and its asset id
+_OutputLocation = Tuple[str, Identifier, Identifier]
+
+
 class WorkflowPlanner:
     """Plans workflow execution across sites in a DDM."""
     def __init__(
@@ -51,17 +53,18 @@ class WorkflowPlanner:
         Returns:
             A list of plans that will execute the workflow.
         """
-        logger.debug(
-                'Rules:'
-                f' {self._policy_evaluator._policy_collection.policies()}')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                    'Rules: %s',
+                    self._policy_evaluator._policy_collection.policies())
         permissions = self._permission_calculator.calculate_permissions(job)
-        logger.debug(f'Workflow permissions: {permissions}')
+        logger.debug('Workflow permissions: %s', permissions)
 
         # if we cannot access or use the outputs, then there are no
         # plans
         for output in job.workflow.outputs:
             output_perms = permissions[output]
-            logger.debug(f'perms for {output}: {output_perms}')
+            logger.debug('perms for %s: %s', output, output_perms)
             if not self._policy_evaluator.may_access(
                     output_perms, submitting_site):
                 logger.debug('Submitter may not access results')
@@ -74,9 +77,14 @@ class WorkflowPlanner:
         sites = self._registry_client.list_sites_with_runners()
         permitted_sites = self._permission_calculator.permitted_sites(
                 job, sites, permissions)
-        logger.debug(f'Permitted sites: {permitted_sites}')
+        logger.debug('Permitted sites: %s', permitted_sites)
 
-        sorted_steps = self._sort_workflow(job.workflow)
+        # if a step cannot run anywhere, then there are no plans
+        if not all(permitted_sites.values()):
+            logger.debug('No permitted sites for some steps')
+            return []
+
+        sorted_steps = job.workflow.sorted_steps()
         sorted_step_names = [step.name for step in sorted_steps]
 
         plan = [Identifier('*')] * len(sorted_steps)
@@ -99,33 +107,6 @@ class WorkflowPlanner:
                 Plan(dict(zip(sorted_step_names, plan)))
                 for plan in plan_from(0)]
 
-    def _sort_workflow(self, workflow: Workflow) -> List[WorkflowStep]:
-        """Sorts the workflow's steps topologically.
-
-        In the returned list, each step is preceded by the ones it
-        depends on.
-        """
-        # find dependencies for each step
-        deps = dict()       # type: Dict[WorkflowStep, List[WorkflowStep]]
-        for step in workflow.steps.values():
-            step_deps = list()   # type: List[WorkflowStep]
-            for name, ref in step.inputs.items():
-                if '.' in ref:
-                    dep_name = ref.split('.')[0]
-                    step_deps.append(workflow.steps[dep_name])
-            deps[step] = step_deps
-
-        # sort based on dependencies
-        result = list()     # type: List[WorkflowStep]
-        while len(result) < len(workflow.steps):
-            for step in workflow.steps.values():
-                if step in result:
-                    continue
-                if all([dep in result for dep in deps[step]]):
-                    result.append(step)
-                    break
-        return result
-
 
 class WorkflowExecutor:
     """Executes workflows across sites in a DDM."""
@@ -146,11 +127,16 @@ class WorkflowExecutor:
         Args:
             request: The job and plan to execute.
 
-        Returns:
-            A dictionary of results, indexed by workflow output name.
+        Raises:
+            RuntimeError: If a site could not be reached or refused
+                    the request.
         """
-        for site_id in set(request.plan.step_sites.values()):
-            self._site_rest_client.submit_request(site_id, request)
+        submissions = [
+                self._site_rest_client.submit_request(site_id, request)
+                for site_id in set(request.plan.step_sites.values())]
+
+        for submission in submissions:
+            submission.result()
 
     def is_done(self, request: ExecutionRequest) -> bool:
         """Checks whether a request is done.
@@ -158,13 +144,7 @@ class WorkflowExecutor:
         Returns:
             True iff the request is done.
         """
-        wf = request.job.workflow
-        id_hashes = request.job.id_hashes()
-        for wf_outp_name, wf_outp_source in wf.outputs.items():
-            src_step_name, src_step_output = wf_outp_source.split('.')
-            src_site = request.plan.step_sites[src_step_name]
-            outp_id_hash = id_hashes[wf_outp_name]
-            asset_id = Identifier.from_id_hash(outp_id_hash)
+        for _, src_site, asset_id in self._output_locations(request):
             try:
                 self._site_rest_client.retrieve_asset(src_site, asset_id)
             except KeyError:
@@ -182,26 +162,46 @@ class WorkflowExecutor:
         Returns:
             A dictionary of results, indexed by workflow output name.
         """
-        wf = request.job.workflow
-        id_hashes = request.job.id_hashes()
+        pending = self._output_locations(request)
         results = dict()    # type: Dict[str, Any]
-        while len(results) < len(wf.outputs):
-            for wf_outp_name, wf_outp_source in wf.outputs.items():
-                if wf_outp_name not in results:
-                    src_step_name, src_step_output = wf_outp_source.split('.')
-                    src_site = request.plan.step_sites[src_step_name]
-                    outp_id_hash = id_hashes[wf_outp_name]
-                    try:
-                        asset_id = Identifier.from_id_hash(outp_id_hash)
-                        asset = self._site_rest_client.retrieve_asset(
-                                src_site, asset_id)
-                        results[wf_outp_name] = asset
-                    except KeyError:
-                        continue
+        while True:
+            still_pending = list()  # type: List[_OutputLocation]
+            for wf_outp_name, src_site, asset_id in pending:
+                try:
+                    asset = self._site_rest_client.retrieve_asset(
+                            src_site, asset_id)
+                    results[wf_outp_name] = asset
+                except KeyError:
+                    still_pending.append((wf_outp_name, src_site, asset_id))
+
+            pending = still_pending
+            if not pending:
+                break
             sleep(5)
 
         return results
 
+    def _output_locations(
+            self, request: ExecutionRequest) -> List[_OutputLocation]:
+        """Finds where the outputs of a request will be stored.
+
+        Args:
+            request: The job that was submitted.
+
+        Returns:
+            A list with for each workflow output its name, the site
+            that will have it, and its asset id.
+        """
+        wf = request.job.workflow
+        id_hashes = request.job.id_hashes()
+        locations = list()  # type: List[_OutputLocation]
+        for wf_outp_name, wf_outp_source in wf.outputs.items():
+            src_step_name = wf_outp_source.split('.')[0]
+            locations.append((
+                    wf_outp_name, request.plan.step_sites[src_step_name],
+                    Identifier.from_id_hash(id_hashes[wf_outp_name])))
+        return locations
+
 
 class WorkflowOrchestrator:
     """Plans and runs workflows across sites in DDM.
@@ -1,6 +1,6 @@
 """Functionality for connecting to the central registry."""
 from pathlib import Path
-from typing import Any, Callable, List, Optional, Set, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
 
@@ -38,6 +38,7 @@ class RegistryClient:
             registry: The registry to connect to.
         """
         self._callbacks = list()    # type: List[RegistryCallback]
+        self._sites_by_id = dict()  # type: Dict[Identifier, SiteDescription]
         self._registry_replica = _RegistryReplica(
                 registry, on_update=self._on_registry_update)
 
@@ -105,10 +106,10 @@ class RegistryClient:
             KeyError: If no site with that id exists.
 
         """
-        site = self._get_site('id', site_id)
-        if not site:
+        try:
+            return self._sites_by_id[site_id]
+        except KeyError:
             raise KeyError(f'Site with id {site_id} not found')
-        return site
 
     def _get_party(self, party_id: Identifier) -> Optional[PartyDescription]:
         """Returns the party with the given id."""
@@ -118,19 +119,17 @@ class RegistryClient:
                     return o
         return None
 
-    def _get_site(
-            self, attr_name: str, value: Any) -> Optional[SiteDescription]:
-        """Returns a site with a given attribute value."""
-        for o in self._registry_replica.objects:
-            if isinstance(o, SiteDescription):
-                a = getattr(o, attr_name)
-                if a is not None and a == value:
-                    return o
-        return None
-
     def _on_registry_update(
             self, created: Set[RegisteredObject],
             deleted: Set[RegisteredObject]) -> None:
-        """Calls callbacks when sites are updated."""
+        """Updates the site index and calls callbacks."""
+        for o in deleted:
+            if isinstance(o, SiteDescription):
+                if self._sites_by_id.get(o.id) == o:
+                    del self._sites_by_id[o.id]
+        for o in created:
+            if isinstance(o, SiteDescription):
+                self._sites_by_id[o.id] = o
+
         for callback in self._callbacks:
             callback(created, deleted)
@@ -65,6 +65,8 @@ class SiteConfiguration:
         client_key: File with the key for client_cert.
         loglevel: Logging level to use, one of 'critical', 'error',
                 'warning', 'info', or 'debug'.
+        registry_cache_dir: Directory in which to cache the contents
+                of the registry across restarts, if any.
     """
     def __init__(
             self,
@@ -74,7 +76,8 @@ class SiteConfiguration:
             trust_store: Optional[Path] = None,
             client_cert: Optional[Path] = None,
             client_key: Optional[Path] = None,
-            loglevel: str = 'info'
+            loglevel: str = 'info',
+            registry_cache_dir: Optional[Path] = None
             ) -> None:
         """Create a SiteConfiguration object.
 
@@ -91,6 +94,8 @@ class SiteConfiguration:
             client_key: File with the key for client_cert.
             loglevel: Logging level to use, one of 'critical', 'error',
                     'warning', 'info', or 'debug'.
+            registry_cache_dir: Directory in which to cache the
+                    contents of the registry across restarts, if any.
         """
         if owner.kind() != 'party':
             raise ValueError(
@@ -115,6 +120,7 @@ class SiteConfiguration:
         self.client_cert = client_cert
         self.client_key = client_key
         self.loglevel = loglevel
+        self.registry_cache_dir = registry_cache_dir
 
     def client_creds(self) -> Optional[Tuple[Path, Path]]:
         """Get the HTTPS client credentials.
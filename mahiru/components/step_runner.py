@@ -1,8 +1,10 @@
 """Components for on-site workflow execution."""
+from concurrent.futures import (
+        FIRST_COMPLETED, Future, ThreadPoolExecutor, wait)
 import logging
-from threading import Thread
+from threading import Event, Thread
 from time import sleep
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from mahiru.definitions.identifier import Identifier
 from mahiru.definitions.assets import (
@@ -18,7 +20,10 @@ from mahiru.components.asset_store import AssetStore
 logger = logging.getLogger(__name__)
 
 
-class JobRun(Thread):
+_Sources = Dict[str, Tuple[Identifier, Identifier]]
+
+
+class JobRun:
     """A run of a job.
 
     This is a reification of the process of executing a job locally.
@@ -48,7 +53,6 @@ class JobRun(Thread):
             target_store: The asset store to put results into.
 
         """
-        super().__init__(name='JobAtRunner-{}'.format(this_site))
         self._permission_calculator = permission_calculator
         self._site_rest_client = site_rest_client
         self._domain_administrator = domain_administrator
@@ -60,13 +64,22 @@ class JobRun(Thread):
         self._sites = request.plan.step_sites
         self._target_store = target_store
 
+        # Site and asset id to get each step input from, per step
+        self._input_sources = dict()    # type: Dict[str, _Sources]
+        # Inputs retrieved so far, per step
+        self._step_inputs = dict()      # type: Dict[str, Dict[str, Asset]]
+        # Set when the run ends, to stop any steps still waiting
+        self._aborted = Event()
+
     def run(self) -> None:
         """Runs the job.
 
-        This executes the steps in the job one at a time, in an order
-        compatible with their dependencies.
+        This executes the steps in the job in an order compatible with
+        their dependencies. Each step is started as soon as the steps
+        it depends on here have run, so independent steps run in
+        parallel. Started steps wait for any inputs from other sites.
         """
-        logger.info('Starting job at {}'.format(self._this_site))
+        logger.info('Starting job at %s', self._this_site)
         if not self._permission_calculator.is_legal(self._job, self._plan):
             # for each output we were supposed to produce
             #     store an error object instead
@@ -76,19 +89,66 @@ class JobRun(Thread):
 
         id_hashes = self._job.id_hashes()
 
-        steps_to_do = {
-                step for step in self._workflow.steps.values()
+        # Steps we run here, and which of them each one waits for
+        local_steps = {
+                step.name: step for step in self._workflow.steps.values()
                 if self._sites[step.name] == self._this_site}
 
-        while len(steps_to_do) > 0:
-            for step in steps_to_do:
-                success = self._try_execute_step(step, id_hashes)
-                if success:
-                    steps_to_do.remove(step)
-                    break
-            else:
-                sleep(0.5)
-        logger.info('Job at {} done'.format(self._this_site))
+        producers = dict()  # type: Dict[str, Set[str]]
+        consumers = dict()  # type: Dict[str, List[WorkflowStep]]
+        for step in local_steps.values():
+            self._input_sources[step.name] = {
+                    inp_name: self._source(step, inp_name, id_hashes)
+                    for inp_name in step.inputs}
+
+            producers[step.name] = set()
+            for producer in step.dependencies:
+                if producer in local_steps:
+                    producers[step.name].add(producer)
+                    consumers.setdefault(producer, list()).append(step)
+
+        # A started step may be waiting for a remote input that depends
+        # on another local step, so each step needs its own thread.
+        pool = ThreadPoolExecutor(
+                max(len(local_steps), 1),
+                'JobStep-{}'.format(self._this_site))
+        running = dict()    # type: Dict[Future[None], WorkflowStep]
+
+        def start(step: WorkflowStep) -> None:
+            """Start executing a step in the background."""
+            future = pool.submit(self._execute_step, step, id_hashes)
+            running[future] = step
+
+        try:
+            for step in local_steps.values():
+                if not producers[step.name]:
+                    start(step)
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    future.result()
+                    for consumer in consumers.get(step.name, []):
+                        producers[consumer.name].remove(step.name)
+                        if not producers[consumer.name]:
+                            start(consumer)
+        finally:
+            self._aborted.set()
+            pool.shutdown(wait=False)
+
+        logger.info('Job at %s done', self._this_site)
+
+    def _execute_step(
+            self, step: WorkflowStep, id_hashes: Dict[str, str]) -> None:
+        """Execute a step, waiting for its inputs if needed.
+
+        Gives up if the job is aborted because another step failed.
+        """
+        while not self._try_execute_step(step, id_hashes):
+            if self._aborted.is_set():
+                return
+            sleep(0.5)
 
     def _try_execute_step(
             self, step: WorkflowStep, id_hashes: Dict[str, str]
@@ -99,12 +159,13 @@ class JobRun(Thread):
         asset has an associated image then a container run will be
         attempted, otherwise we'll use the built-in hack.
         """
-        inputs = self._get_step_inputs(step, id_hashes)
+        inputs = self._get_step_inputs(step)
         if inputs is not None:
             compute_asset = self._retrieve_compute_asset(step.compute_asset_id)
             if compute_asset.image_location is not None:
-                logger.info('Job at {} executing container step {}'.format(
-                    self._this_site, step))
+                logger.info(
+                        'Job at %s executing container step %s',
+                        self._this_site, step)
 
                 output_bases = self._get_output_bases(step)
                 step_subjob = self._job.subjob(step)
@@ -113,7 +174,7 @@ class JobRun(Thread):
                         step_subjob)
 
                 for name, path in result.files.items():
-                    result_item = '{}.{}'.format(step.name, name)
+                    result_item = step.output_items[name]
                     result_id_hash = id_hashes[result_item]
                     metadata = DataMetadata(step_subjob, result_item)
                     asset = DataAsset(
@@ -128,41 +189,47 @@ class JobRun(Thread):
         return inputs is not None
 
     def _get_step_inputs(
-            self, step: WorkflowStep, id_hashes: Dict[str, str]
-            ) -> Optional[Dict[str, Asset]]:
+            self, step: WorkflowStep) -> Optional[Dict[str, Asset]]:
         """Find and obtain inputs for the step.
 
         If all inputs are available, returns a dictionary mapping their
         names to their values. If at least one input is not yet
-        available, returns None.
+        available, returns None. Inputs that were found are kept, so
+        that the next call only needs to get the remaining ones.
 
         Args:
             step: The step to obtain inputs for.
-            id_hashes: Id hashes for the workflow's items.
 
         Return:
             A dictionary keyed by input name with corresponding
             assets.
 
         """
-        step_input_data = dict()
-        for inp_name, inp_source in step.inputs.items():
-            source_site, source_asset = self._source(inp_source, id_hashes)
-            logger.info('Job at {} getting input {} from site {}'.format(
-                self._this_site, source_asset, source_site))
-            try:
-                asset = self._site_rest_client.retrieve_asset(
-                        source_site, source_asset)
-                step_input_data[inp_name] = asset
-                logger.info('Job at {} found input {} available.'.format(
-                    self._this_site, source_asset))
-                logger.info('Metadata: {}'.format(asset.metadata))
-            except KeyError:
-                logger.info(f'Job at {self._this_site} found input'
-                            f' {source_asset} not yet available.')
-                return None
+        sources = self._input_sources[step.name]
+        found = self._step_inputs.setdefault(step.name, dict())
+        missing = [name for name in sources if name not in found]
+
+        logger.info(
+                'Job at %s getting inputs %s', self._this_site,
+                [sources[name] for name in missing])
+        assets = self._site_rest_client.retrieve_assets(
+                sources[name] for name in missing)
+
+        for name, asset in zip(missing, assets):
+            if asset is not None:
+                logger.info(
+                        'Job at %s found input %s available.',
+                        self._this_site, asset.id)
+                logger.info('Metadata: %s', asset.metadata)
+                found[name] = asset
+
+        if len(found) < len(sources):
+            logger.info(
+                    'Job at %s found inputs for step %s not yet available.',
+                    self._this_site, step.name)
+            return None
 
-        return step_input_data
+        return {name: found[name] for name in sources}
 
     def _get_output_bases(self, step: WorkflowStep) -> Dict[str, Asset]:
         """Find and obtain output base assets for the compute asset.
@@ -186,9 +253,9 @@ class JobRun(Thread):
                 step_output_bases[out_name] = asset
             except KeyError:
                 logger.info(
-                        f'Could not retrieve output base asset'
-                        f' {asset_id} for output {out_name} of step'
-                        f' {step.name}')
+                        'Could not retrieve output base asset %s for'
+                        ' output %s of step %s', asset_id, out_name,
+                        step.name)
                 raise
         return step_output_bases
 
@@ -196,8 +263,7 @@ class JobRun(Thread):
             self, step: WorkflowStep, inputs: Dict[str, Asset],
             compute_asset: ComputeAsset, id_hashes: Dict[str, str]) -> None:
         """Run a workflow step."""
-        logger.info('Job at {} executing step {}'.format(
-            self._this_site, step))
+        logger.info('Job at %s executing step %s', self._this_site, step)
 
         # run compute asset step
         outputs = compute_asset.run(
@@ -207,7 +273,7 @@ class JobRun(Thread):
         results = list()    # type: List[DataAsset]
         step_subjob = self._job.subjob(step)
         for output_name, output_value in outputs.items():
-            result_item = '{}.{}'.format(step.name, output_name)
+            result_item = step.output_items[output_name]
             result_id_hash = id_hashes[result_item]
             metadata = DataMetadata(step_subjob, result_item)
             asset = DataAsset(
@@ -224,29 +290,32 @@ class JobRun(Thread):
         return asset
 
     def _source(
-            self, inp_source: str, id_hashes: Dict[str, str]
+            self, step: WorkflowStep, inp_name: str,
+            id_hashes: Dict[str, str]
             ) -> Tuple[Identifier, Identifier]:
-        """Extracts the source from a source description.
+        """Finds the source of a step input.
 
-        If the input is of the form 'step.output', this will return the
-        target site which is to execute that step according to the
-        current plan, and the output (result) identifier.
+        If the input is connected to the output of another step, this
+        will return the target site which is to execute that step
+        according to the current plan, and the output (result)
+        identifier.
 
         If the input is a reference to a workflow input, then this will
         return the site where the corresponding workflow input can be
         found, and its asset id.
 
         Args:
-            inp_source: Source description as above.
+            step: The step the input belongs to.
+            inp_name: The name of the input.
             id_hashes: Id hashes for the workflow's items.
 
         """
-        if '.' in inp_source:
-            step_name, output_name = inp_source.split('.')
-            return self._sites[step_name], Identifier.from_id_hash(
-                    id_hashes[inp_source])
+        src_step, src_name = step.input_sources[inp_name]
+        if src_step is not None:
+            return self._sites[src_step], Identifier.from_id_hash(
+                    id_hashes[step.input_items[inp_name]])
         else:
-            dataset = self._inputs[inp_source]
+            dataset = self._inputs[src_name]
             return dataset.location(), dataset
 
 
@@ -276,6 +345,10 @@ class StepRunner(IStepRunner):
     def execute_request(self, request: ExecutionRequest) -> None:
         """Start a job in a separate thread.
 
+        Each job gets a thread of its own. Jobs wait for results from
+        other sites, so jobs queued for a limited number of threads
+        could end up waiting for each other across sites.
+
         Args:
             request: The job to execute and plan to do it.
 
@@ -284,4 +357,14 @@ class StepRunner(IStepRunner):
                 self._site_rest_client, self._permission_calculator,
                 self._domain_administrator, self._site, request,
                 self._target_store)
-        run.start()
+        thread = Thread(
+                target=self._run_job, args=(run,),
+                name='JobAtRunner-{}'.format(self._site))
+        thread.start()
+
+    def _run_job(self, run: JobRun) -> None:
+        """Run a job, and log it if it fails."""
+        try:
+            run.run()
+        except Exception:
+            logger.exception('Job at %s failed', self._site)
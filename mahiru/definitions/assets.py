@@ -1,5 +1,5 @@
 """Classes for describing assets."""
-from typing import Any, Dict, Optional, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from mahiru.definitions.identifier import Identifier
 from mahiru.definitions.workflows import Job
@@ -136,18 +136,20 @@ class ComputeAsset(Asset):
                 output name with corresponding values.
 
         """
-        outputs = dict()  # type: Dict[str, Any]
-        if 'combine' in self.id:
-            outputs['y'] = [inputs['x1'], inputs['x2']]
-        elif 'anonymise' in self.id:
-            outputs['y'] = [x - 10 for x in inputs['x1']]
-        elif 'aggregate' in self.id:
-            outputs['y'] = sum(inputs['x1']) / len(inputs['x1'])
-        elif 'addition' in self.id:
-            outputs['y'] = inputs['x1'] + inputs['x2']
-        else:
-            raise RuntimeError('Unknown compute asset')
-        return outputs
+        for keyword, algorithm in _builtin_algorithms:
+            if keyword in self.id:
+                return {'y': algorithm(inputs)}
+        raise RuntimeError('Unknown compute asset')
+
+
+# Algorithms for ComputeAsset.run(), by a keyword in the asset id,
+# tried in order.
+_builtin_algorithms = [
+        ('combine', lambda inputs: [inputs['x1'], inputs['x2']]),
+        ('anonymise', lambda inputs: [x - 10 for x in inputs['x1']]),
+        ('aggregate', lambda inputs: sum(inputs['x1']) / len(inputs['x1'])),
+        ('addition', lambda inputs: inputs['x1'] + inputs['x2'])
+        ]   # type: List[Tuple[str, Callable[[Dict[str, Any]], Any]]]
 
 
 class DataAsset(Asset):
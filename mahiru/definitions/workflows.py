@@ -1,5 +1,6 @@
 """Classes for describing workflows."""
 from hashlib import sha256
+from heapq import heappop, heappush
 from typing import Dict, List, Mapping, Optional, Set, Tuple, Union
 
 from mahiru.definitions.identifier import Identifier
@@ -41,6 +42,33 @@ class WorkflowStep:
             compute_asset_id = Identifier(compute_asset_id)
         self.compute_asset_id = compute_asset_id
 
+        # Names of our inputs, outputs and output bases as workflow
+        # items, i.e. step.input, step.output and step.@output.
+        self.input_items = {
+                inp: '{}.{}'.format(self.name, inp) for inp in self.inputs}
+        self.output_items = {
+                outp: '{}.{}'.format(self.name, outp)
+                for outp in self.outputs}
+        self.output_base_items = {
+                outp: '{}.@{}'.format(self.name, outp)
+                for outp in self.outputs}
+
+        # Where each input comes from, as (step, output) for outputs
+        # of other steps and (None, input) for workflow inputs
+        self.input_sources = dict(
+                )   # type: Dict[str, Tuple[Optional[str], str]]
+        for inp, inp_source in self.inputs.items():
+            src_step, dot, src_output = inp_source.partition('.')
+            if dot:
+                self.input_sources[inp] = (src_step, src_output)
+            else:
+                self.input_sources[inp] = (None, inp_source)
+
+        # Names of the steps whose outputs we use, without duplicates
+        self.dependencies = tuple(dict.fromkeys(
+                src_step for src_step, _ in self.input_sources.values()
+                if src_step is not None))
+
         self._validate()
 
     def __repr__(self) -> str:
@@ -88,6 +116,7 @@ class Workflow:
             self.steps[step.name] = step
 
         self._validate()
+        self._sorted_steps = self._sort_steps()
 
     def __str__(self) -> str:
         """Returns a string representation of the object."""
@@ -122,6 +151,55 @@ class Workflow:
                         'Duplicate name {} among workflow steps, inputs'
                         ' and outputs').format(name1))
 
+    def sorted_steps(self) -> Tuple[WorkflowStep, ...]:
+        """Returns the workflow's steps, sorted topologically.
+
+        In the returned tuple, each step is preceded by the ones it
+        depends on. Where there is a choice, steps are kept in the
+        order in which they were given.
+        """
+        return self._sorted_steps
+
+    def _sort_steps(self) -> Tuple[WorkflowStep, ...]:
+        """Sorts the workflow's steps topologically.
+
+        See sorted_steps().
+
+        Raises:
+            RuntimeError: If a step uses an output of a step that does
+                    not exist, or if steps depend on each other in a
+                    cycle.
+        """
+        steps = tuple(self.steps.values())
+
+        # find dependencies for each step
+        num_deps = [len(step.dependencies) for step in steps]
+        dependents = [list() for _ in steps]    # type: List[List[int]]
+        index = {step.name: i for i, step in enumerate(steps)}
+        for i, step in enumerate(steps):
+            for dep_name in step.dependencies:
+                if dep_name not in index:
+                    raise RuntimeError(
+                            'Step {} uses output of unknown step {}'.format(
+                                step.name, dep_name))
+                dependents[index[dep_name]].append(i)
+
+        # sort based on dependencies, picking the first step in the
+        # workflow that is ready each time to keep the order stable
+        ready = [i for i in range(len(steps)) if num_deps[i] == 0]
+        result = list()     # type: List[WorkflowStep]
+        while ready:
+            i = heappop(ready)
+            result.append(steps[i])
+            for j in dependents[i]:
+                num_deps[j] -= 1
+                if num_deps[j] == 0:
+                    heappush(ready, j)
+
+        if len(result) < len(steps):
+            raise RuntimeError('Workflow steps depend on each other')
+        return tuple(result)
+
     def subworkflow(self, step: WorkflowStep) -> 'Workflow':
         """Returns a minimal subworkflow that creates the given step.
 
@@ -153,9 +231,8 @@ class Workflow:
             preds = set()   # type: Set[WorkflowStep]
             inps = set()    # type: Set[str]
             for step in steps_done:
-                for inp in step.inputs.values():
-                    if '.' in inp:
-                        pred_name = inp.split('.')[0]
+                for pred_name, inp in step.input_sources.values():
+                    if pred_name is not None:
                         pred = self.steps[pred_name]
                         if pred not in steps_done:
                             preds.add(pred)
@@ -241,9 +318,6 @@ class Job:
         Returns:
             A dict mapping workflow items to their id hash.
         """
-        class DependencyMissing(RuntimeError):
-            pass
-
         def prop_input_id_hashes(item_id_hashes: Dict[str, str]) -> None:
             for inp_name, inp_src in self.inputs.items():
                 inp_id_hash = sha256()
@@ -253,23 +327,21 @@ class Job:
         def prop_input_sources(
                 item_id_hashes: Dict[str, str], step: WorkflowStep) -> None:
             for inp_name, inp_src in step.inputs.items():
-                inp_item = '{}.{}'.format(step.name, inp_name)
+                inp_item = step.input_items[inp_name]
                 if inp_item not in item_id_hashes:
-                    if inp_src not in item_id_hashes:
-                        raise DependencyMissing()
                     item_id_hashes[inp_item] = item_id_hashes[inp_src]
 
         def calc_step_outputs(
                 item_id_hashes: Dict[str, str], step: WorkflowStep) -> None:
             step_hash = sha256()
             for inp_name in sorted(step.inputs):
-                inp_item = '{}.{}'.format(step.name, inp_name)
+                inp_item = step.input_items[inp_name]
                 step_hash.update(
                         item_id_hashes[inp_item].encode('utf-8'))
             step_hash.update(
                     step.compute_asset_id.encode('utf-8'))
             for outp_name in step.outputs:
-                outp_item = '{}.{}'.format(step.name, outp_name)
+                outp_item = step.output_items[outp_name]
                 outp_hash = step_hash.copy()
                 outp_hash.update(outp_name.encode('utf-8'))
                 item_id_hashes[outp_item] = outp_hash.hexdigest()
@@ -283,16 +355,10 @@ class Job:
         item_id_hashes = dict()      # type: Dict[str, str]
         prop_input_id_hashes(item_id_hashes)
 
-        steps_done = set()      # type: Set[str]
-        while len(steps_done) < len(self.workflow.steps):
-            for step in self.workflow.steps.values():
-                if step.name not in steps_done:
-                    try:
-                        prop_input_sources(item_id_hashes, step)
-                        calc_step_outputs(item_id_hashes, step)
-                        steps_done.add(step.name)
-                    except DependencyMissing:
-                        continue
+        # sources come before the steps that use them
+        for step in self.workflow.sorted_steps():
+            prop_input_sources(item_id_hashes, step)
+            calc_step_outputs(item_id_hashes, step)
 
         set_workflow_outputs_id_hashes(item_id_hashes, self.workflow.outputs)
         return item_id_hashes
@@ -1,20 +1,33 @@
 """Components for evaluating workflow permissions."""
 from typing import (
-        Callable, Dict, Iterable, List, Optional, Set, Union, Tuple, Type,
-        TypeVar)
+        Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Union,
+        Tuple, Type, TypeVar)
 
 from mahiru.definitions.identifier import Identifier
 from mahiru.definitions.interfaces import IPolicyCollection
+from mahiru.definitions.policy import Rule
 from mahiru.definitions.workflows import Job, Plan, Workflow, WorkflowStep
 from mahiru.policy.rules import (
         GroupingRule, InAssetCategory, InAssetCollection, InPartyCategory,
-        InSiteCategory, MayAccess, MayUse, ResultOfIn, ResultOfDataIn,
-        ResultOfComputeIn)
+        InSiteCategory, MayAccess, MayUse, ResultOfDataIn, ResultOfComputeIn)
 
 
 _GroupingRule = TypeVar('_GroupingRule', bound=GroupingRule)
 
 
+_Edges = Dict[Identifier, List[Identifier]]
+
+
+_Objects = FrozenSet[Identifier]
+
+
+_EquivKey = Tuple[type, str, Union[Identifier, _Objects]]
+
+
+_Propagations = Dict[
+        Tuple[_Objects, Identifier, str], Tuple[_Objects, _Objects]]
+
+
 class Permissions:
     """Represents permissions for an asset."""
     def __init__(self, sets: Optional[List[Set[Identifier]]] = None) -> None:
@@ -33,6 +46,155 @@ class Permissions:
         return 'Permissions({})'.format(repr(self._sets))
 
 
+class _PolicyIndex:
+    """Indexes a set of rules for fast lookup.
+
+    Evaluating policies means following chains of rules, and scanning
+    all rules for each link is slow. This sorts them once by type and
+    by the asset or object they start from.
+
+    The index is only valid for the rules it was built from; the
+    PolicyEvaluator makes a new one when the policies change.
+    """
+    def __init__(self, rules: List[Rule]) -> None:
+        """Create a _PolicyIndex.
+
+        Args:
+            rules: The rules to index.
+        """
+        self.rules = rules
+
+        # Assets that each site/party may access/use
+        self._may_access = dict()   # type: Dict[Identifier, Set[Identifier]]
+        self._may_use = dict()      # type: Dict[Identifier, Set[Identifier]]
+        self._accessible = dict()   # type: Dict[_Objects, _Objects]
+        self._usable = dict()       # type: Dict[_Objects, _Objects]
+
+        # ResultOfDataIn rules by data asset, ResultOfComputeIn rules
+        # by compute asset
+        self.result_of_data_in = dict(
+                )   # type: Dict[Identifier, List[ResultOfDataIn]]
+        self.result_of_compute_in = dict(
+                )   # type: Dict[Identifier, List[ResultOfComputeIn]]
+
+        # Per (rule type, direction), near end to far ends
+        self._grouping = dict()     # type: Dict[Tuple[type, str], _Edges]
+        self._equivalents = dict()  # type: Dict[_EquivKey, _Objects]
+
+        # Memo for PolicyEvaluator._resultofin_collections()
+        self.propagations = dict()  # type: _Propagations
+
+        for rule in rules:
+            if isinstance(rule, MayAccess):
+                self._may_access.setdefault(rule.site, set()).add(rule.asset)
+            elif isinstance(rule, MayUse):
+                self._may_use.setdefault(rule.party, set()).add(rule.asset)
+            elif isinstance(rule, ResultOfDataIn):
+                self.result_of_data_in.setdefault(
+                        rule.data_asset, list()).append(rule)
+            elif isinstance(rule, ResultOfComputeIn):
+                self.result_of_compute_in.setdefault(
+                        rule.compute_asset, list()).append(rule)
+
+    def accessible_assets(self, sites: _Objects) -> _Objects:
+        """Return the assets any of the given sites may access.
+
+        Args:
+            sites: A set of sites and site categories.
+        """
+        result = self._accessible.get(sites)
+        if result is None:
+            result = self._allowed_assets(self._may_access, sites)
+            self._accessible[sites] = result
+        return result
+
+    def usable_assets(self, parties: _Objects) -> _Objects:
+        """Return the assets any of the given parties may use.
+
+        Args:
+            parties: A set of parties and party categories.
+        """
+        result = self._usable.get(parties)
+        if result is None:
+            result = self._allowed_assets(self._may_use, parties)
+            self._usable[parties] = result
+        return result
+
+    def _allowed_assets(
+            self, rules: Dict[Identifier, Set[Identifier]],
+            subjects: _Objects) -> _Objects:
+        """Collect assets allowed to any subject or to anyone."""
+        result = set(rules.get(Identifier('*'), ()))
+        for subject in subjects:
+            result.update(rules.get(subject, ()))
+        return frozenset(result)
+
+    def grouping_edges(
+            self, rule_type: Type[_GroupingRule], direction: str) -> _Edges:
+        """Return the grouping rules of a type as a graph.
+
+        Args:
+            rule_type: Type of rule to follow, e.g. InAssetCategory.
+            direction: Either 'up' or 'down'.
+
+        Returns:
+            A dictionary mapping objects to the objects that they are
+            directly grouped into (up) or that they group (down).
+        """
+        key = (rule_type, direction)
+        edges = self._grouping.get(key)
+        if edges is None:
+            if direction == 'up':
+                near_end, far_end = rule_type.grouped, rule_type.group
+            else:
+                near_end, far_end = rule_type.group, rule_type.grouped
+
+            edges = dict()
+            for rule in self.rules:
+                if isinstance(rule, rule_type):
+                    edges.setdefault(near_end(rule), list()).append(
+                            far_end(rule))
+            self._grouping[key] = edges
+        return edges
+
+    def equivalent_objects(
+            self, rule_type: Type[_GroupingRule],
+            direction: str,
+            obj: Union[Identifier, Set[Identifier]]
+            ) -> _Objects:
+        """Return objects reachable by traversing grouping rules.
+
+        Results are memoised, as the same assets and sites come up
+        again and again while evaluating a workflow.
+
+        Args:
+            rule_type: Type of rule to follow, e.g. InAssetCategory.
+            direction: Either 'up' or 'down'.
+            obj: The objects or object categories to find equivalents
+                    for.
+        """
+        if isinstance(obj, set):
+            key = rule_type, direction, frozenset(obj)  # type: _EquivKey
+        else:
+            key = rule_type, direction, obj
+
+        result = self._equivalents.get(key)
+        if result is None:
+            edges = self.grouping_edges(rule_type, direction)
+
+            cur_objects = set()      # type: Set[Identifier]
+            new_objects = obj if isinstance(obj, set) else {obj}
+            while new_objects:
+                cur_objects |= new_objects
+                new_objects = {
+                        far for o in new_objects for far in edges.get(o, ())
+                        if far not in cur_objects}
+
+            result = frozenset(cur_objects)
+            self._equivalents[key] = result
+        return result
+
+
 class PolicyEvaluator:
     """Interprets policies to support planning and execution."""
     def __init__(self, policy_collection: IPolicyCollection) -> None:
@@ -42,6 +204,7 @@ class PolicyEvaluator:
             policy_collection: A collections of policies to evaluate.
         """
         self._policy_collection = policy_collection
+        self._index = None      # type: Optional[_PolicyIndex]
 
     def permissions_for_asset(self, asset: Identifier) -> Permissions:
         """Returns permissions for the given asset.
@@ -52,9 +215,10 @@ class PolicyEvaluator:
         Args:
             asset: The asset to get permissions for.
         """
+        index = self._get_index()
         result = Permissions()
-        result._sets = [self._equivalent_objects(
-            InAssetCollection, 'up', asset)]
+        result._sets = [set(index.equivalent_objects(
+            InAssetCollection, 'up', asset))]
         return result
 
     def propagate_permissions(
@@ -79,13 +243,21 @@ class PolicyEvaluator:
         Returns:
             The access permissions of the results.
         """
+        index = self._get_index()
         result = Permissions()
         for input_perms in input_permissions:
             for asset_set in input_perms._sets:
-                data_coll, compute_coll = self._resultofin_collections(
-                        asset_set, compute_asset, output)
-                result._sets.append(data_coll)
-                result._sets.append(compute_coll)
+                # the same sets tend to flow into many steps
+                key = frozenset(asset_set), compute_asset, output
+                collections = index.propagations.get(key)
+                if collections is None:
+                    collections = self._resultofin_collections(
+                            index, asset_set, compute_asset, output)
+                    index.propagations[key] = collections
+
+                data_coll, compute_coll = collections
+                result._sets.append(set(data_coll))
+                result._sets.append(set(compute_coll))
 
         return result
 
@@ -99,29 +271,13 @@ class PolicyEvaluator:
             permissions: Permissions for the asset to check.
             site: A site which needs access.
         """
-        def matches_one(
-                asset_set: Set[Identifier], equiv_sites: Set[Identifier]
-                ) -> bool:
-            """Check for access matches.
-
-            Returns:
-                True iff there's an asset in asset_set a site in
-                equiv_sites has access to.
-            """
-            equiv_assets = self._equivalent_objects(
-                    InAssetCollection, 'up', asset_set)
-            for asset in equiv_assets:
-                for rule in self._policy_collection.policies():
-                    if isinstance(rule, MayAccess):
-                        if rule.asset == asset and rule.site in equiv_sites:
-                            return True
-                        if rule.asset == asset and rule.site == '*':
-                            return True
-            return False
-
-        equiv_sites = self._equivalent_objects(InSiteCategory, 'up', site)
-        return all([matches_one(asset_set, equiv_sites)
-                    for asset_set in permissions._sets])
+        index = self._get_index()
+        equiv_sites = index.equivalent_objects(InSiteCategory, 'up', site)
+        accessible = index.accessible_assets(equiv_sites)
+        return all(
+                not accessible.isdisjoint(index.equivalent_objects(
+                    InAssetCollection, 'up', asset_set))
+                for asset_set in permissions._sets)
 
     def may_use(self, permissions: Permissions, party: Identifier) -> bool:
         """Checks whether an asset can be used by a party.
@@ -133,68 +289,31 @@ class PolicyEvaluator:
             permissions: Permissions for the asset to check.
             party: A party which needs use rights.
         """
-        def matches_one(
-                asset_set: Set[Identifier], equiv_parties: Set[Identifier]
-                ) -> bool:
-            """Check for usage matches.
-
-            Returns:
-                True iff there's an asset in asset_set a party in
-                equiv_parties may use.
-            """
-            equiv_assets = self._equivalent_objects(
-                    InAssetCollection, 'up', asset_set)
-            for asset in equiv_assets:
-                for rule in self._policy_collection.policies():
-                    if isinstance(rule, MayUse):
-                        if rule.asset == asset and rule.party in equiv_parties:
-                            return True
-                        if rule.asset == asset and rule.party == '*':
-                            return True
-            return False
-
-        equiv_parties = self._equivalent_objects(InPartyCategory, 'up', party)
-        return all([matches_one(asset_set, equiv_parties)
-                    for asset_set in permissions._sets])
-
-    def _equivalent_objects(
-            self, rule_type: Type[_GroupingRule],
-            direction: str,
-            obj: Union[Identifier, Set[Identifier]]
-            ) -> Set[Identifier]:
-        """Return objects reachable by traversing grouping rules.
-
-        Args:
-            rule_type: Type of rule to follow, e.g. InAssetCategory.
-            direction: Either 'up' or 'down'.
-            obj: The objects or object categories to find equivalents
-                    for.
+        index = self._get_index()
+        equiv_parties = index.equivalent_objects(InPartyCategory, 'up', party)
+        usable = index.usable_assets(equiv_parties)
+        return all(
+                not usable.isdisjoint(index.equivalent_objects(
+                    InAssetCollection, 'up', asset_set))
+                for asset_set in permissions._sets)
+
+    def _get_index(self) -> _PolicyIndex:
+        """Return an index of the current policies.
+
+        This gets the policies from the collection, and reindexes them
+        if they are different from what we had last time.
         """
-        if not isinstance(obj, set):
-            obj = {obj}
-
-        if direction == 'up':
-            near_end, far_end = rule_type.grouped, rule_type.group
-        else:
-            near_end, far_end = rule_type.group, rule_type.grouped
-
-        cur_objects = set()      # type: Set[Identifier]
-        new_objects = obj
-        while new_objects:
-            cur_objects |= new_objects
-            new_objects = set()
-            for o in cur_objects:
-                for rule in self._policy_collection.policies():
-                    if isinstance(rule, rule_type):
-                        if near_end(rule) == o:
-                            if far_end(rule) not in cur_objects:
-                                new_objects.add(far_end(rule))
-        return cur_objects
+        rules = list(self._policy_collection.policies())
+        index = self._index
+        if index is None or index.rules != rules:
+            index = _PolicyIndex(rules)
+            self._index = index
+        return index
 
     def _resultofin_collections(
-            self, input_assets: Set[Identifier],
+            self, index: _PolicyIndex, input_assets: Set[Identifier],
             compute_asset: Identifier, output: str,
-            ) -> Tuple[Set[Identifier], Set[Identifier]]:
+            ) -> Tuple[_Objects, _Objects]:
         """Returns collections these assets propagate to.
 
         This finds ResultOfIn rules that apply to the given assets,
@@ -203,44 +322,46 @@ class PolicyEvaluator:
         rules and the second one for ResultOfComputein rules.
 
         Args:
+            index: Index of the policies to apply.
             input_assets: Set of data assets to match rules to.
             compute_asset: Compute asset to match rules to.
             output: Output to match rules to.
         """
-        data_collections, compute_collections = set(), set()
+        data_collections = set()        # type: Set[Identifier]
+        compute_collections = set()     # type: Set[Identifier]
 
-        input_assets_colls = {
-                a for input_asset in input_assets
-                for a in self._equivalent_objects(
-                    InAssetCollection, 'up', input_asset)}
-        compute_asset_colls = self._equivalent_objects(
+        input_assets_colls = index.equivalent_objects(
+                InAssetCollection, 'up', input_assets)
+        compute_asset_colls = index.equivalent_objects(
                 InAssetCollection, 'up', compute_asset)
 
-        for rule in self._policy_collection.policies():
-            if isinstance(rule, ResultOfIn):
-                if rule.output != '*' and rule.output != output:
+        for data_asset in input_assets_colls:
+            for data_rule in index.result_of_data_in.get(data_asset, []):
+                if data_rule.output not in ('*', output):
                     continue
 
-            if isinstance(rule, ResultOfDataIn):
-                if rule.data_asset in input_assets_colls:
-                    if rule.compute_asset == '*':
-                        data_collections.add(rule.collection)
-                    elif compute_asset in self._equivalent_objects(
-                            InAssetCategory, 'down', rule.compute_asset):
-                        data_collections.add(rule.collection)
+                if data_rule.compute_asset == '*':
+                    data_collections.add(data_rule.collection)
+                elif compute_asset in index.equivalent_objects(
+                        InAssetCategory, 'down', data_rule.compute_asset):
+                    data_collections.add(data_rule.collection)
 
-            elif isinstance(rule, ResultOfComputeIn):
-                if rule.compute_asset in compute_asset_colls:
-                    if rule.data_asset == '*':
-                        compute_collections.add(rule.collection)
-                        continue
+        for compute_asset_coll in compute_asset_colls:
+            for compute_rule in index.result_of_compute_in.get(
+                    compute_asset_coll, []):
+                if compute_rule.output not in ('*', output):
+                    continue
+
+                if compute_rule.data_asset == '*':
+                    compute_collections.add(compute_rule.collection)
+                    continue
 
-                    equiv_data_assets = self._equivalent_objects(
-                            InAssetCategory, 'down', rule.data_asset)
-                    if not input_assets.isdisjoint(equiv_data_assets):
-                        compute_collections.add(rule.collection)
+                equiv_data_assets = index.equivalent_objects(
+                        InAssetCategory, 'down', compute_rule.data_asset)
+                if not input_assets.isdisjoint(equiv_data_assets):
+                    compute_collections.add(compute_rule.collection)
 
-        return data_collections, compute_collections
+        return frozenset(data_collections), frozenset(compute_collections)
 
 
 class PermissionCalculator:
@@ -280,9 +401,6 @@ class PermissionCalculator:
                         self._policy_evaluator.permissions_for_asset(
                             inp_asset))
 
-        class InputNotAvailable(RuntimeError):
-            pass
-
         def prop_input_sources(
                 permissions: Dict[str, Permissions],
                 step: WorkflowStep
@@ -290,17 +408,10 @@ class PermissionCalculator:
             """Propagates permissions of a step input from its source.
 
             This modifies the permissions argument.
-
-            Raises:
-                InputNotAvailable if the input source is not (yet)
-                available.
             """
             for inp, inp_source in step.inputs.items():
-                inp_item = '{}.{}'.format(step.name, inp)
+                inp_item = step.input_items[inp]
                 if inp_item not in permissions:
-                    if inp_source not in permissions:
-                        # TODO: does this ever happen?
-                        raise InputNotAvailable()
                     permissions[inp_item] = permissions[inp_source]
 
         def calc_step_permissions(
@@ -319,7 +430,7 @@ class PermissionCalculator:
 
             for outp, base_asset in step.outputs.items():
                 if base_asset is not None:
-                    outp_base_item = '{}.@{}'.format(step.name, outp)
+                    outp_base_item = step.output_base_items[outp]
                     permissions[outp_base_item] = (
                             self._policy_evaluator.permissions_for_asset(
                                 base_asset))
@@ -339,19 +450,19 @@ class PermissionCalculator:
             """
             input_perms = list()     # type: List[Permissions]
             for inp in step.inputs:
-                inp_item = '{}.{}'.format(step.name, inp)
+                inp_item = step.input_items[inp]
                 input_perms.append(permissions[inp_item])
 
             for output in step.outputs:
                 o_input_perms = list(input_perms)
-                base_item = '{}.@{}'.format(step.name, output)
+                base_item = step.output_base_items[output]
                 if base_item in permissions:
                     o_input_perms.append(permissions[base_item])
 
                 perms = self._policy_evaluator.propagate_permissions(
                             o_input_perms, step.compute_asset_id, output)
 
-                output_item = '{}.{}'.format(step.name, output)
+                output_item = step.output_items[output]
                 permissions[output_item] = perms
 
         def set_workflow_outputs_permissions(
@@ -366,17 +477,11 @@ class PermissionCalculator:
         permissions = dict()    # type: Dict[str, Permissions]
         set_input_assets_permissions(permissions, job)
 
-        steps_done = set()  # type: Set[str]
-        while len(steps_done) < len(job.workflow.steps):
-            for step in job.workflow.steps.values():
-                if step.name not in steps_done:
-                    try:
-                        prop_input_sources(permissions, step)
-                        calc_step_permissions(permissions, step)
-                        prop_step_outputs(permissions, step)
-                        steps_done.add(step.name)
-                    except InputNotAvailable:
-                        continue
+        # sources come before the steps that use them
+        for step in job.workflow.sorted_steps():
+            prop_input_sources(permissions, step)
+            calc_step_permissions(permissions, step)
+            prop_step_outputs(permissions, step)
 
         set_workflow_outputs_permissions(permissions, job.workflow)
         return permissions
@@ -405,42 +510,42 @@ class PermissionCalculator:
         if permissions is None:
             permissions = self.calculate_permissions(job)
 
+        sites = list(sites)
+        accessible_at = dict()  # type: Dict[int, Set[Identifier]]
+
+        def sites_with_access(perms: Permissions) -> Set[Identifier]:
+            """Returns the sites that may access an item.
+
+            Items often share a Permissions object, e.g. a step input
+            and the output it is connected to, so we check each object
+            against all sites only once.
+            """
+            key = id(perms)
+            if key not in accessible_at:
+                accessible_at[key] = {
+                        site for site in sites
+                        if self._policy_evaluator.may_access(perms, site)}
+            return accessible_at[key]
+
         result = dict()
         for step in job.workflow.steps.values():
-            allowed_sites = list()
-            for site in sites:
-                site_permitted = True
-
-                # check each input
-                for inp_name in step.inputs:
-                    inp_item = '{}.{}'.format(step.name, inp_name)
-                    inp_perms = permissions[inp_item]
-                    if not self._policy_evaluator.may_access(inp_perms, site):
-                        site_permitted = False
-
-                # check step itself (i.e. compute asset)
-                step_perms = permissions[step.name]
-                if not self._policy_evaluator.may_access(step_perms, site):
-                    site_permitted = False
-
-                # check each output and its base asset
-                for outp_name in step.outputs:
-                    base_item = '{}.@{}'.format(step.name, outp_name)
-                    if base_item in permissions:
-                        base_perms = permissions[base_item]
-                        if not self._policy_evaluator.may_access(
-                                base_perms, site):
-                            site_permitted = False
-
-                    outp_item = '{}.{}'.format(step.name, outp_name)
-                    outp_perms = permissions[outp_item]
-                    if not self._policy_evaluator.may_access(outp_perms, site):
-                        site_permitted = False
-
-                if site_permitted:
-                    allowed_sites.append(site)
-
-            result[step.name] = allowed_sites
+            # inputs, step itself (i.e. compute asset), output bases
+            # and outputs
+            items = list(step.input_items.values())
+            items.append(step.name)
+            items.extend(
+                    base_item for base_item in step.output_base_items.values()
+                    if base_item in permissions)
+            items.extend(step.output_items.values())
+
+            allowed_sites = set(sites)
+            for item in items:
+                allowed_sites &= sites_with_access(permissions[item])
+                if not allowed_sites:
+                    break
+
+            result[step.name] = [
+                    site for site in sites if site in allowed_sites]
 
         return result
 
@@ -1,5 +1,6 @@
 """Central registry of remote-accessible things."""
 import logging
+from threading import Lock
 from typing import Any, cast, Dict, Optional, Type, TypeVar
 
 from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
@@ -26,10 +27,14 @@ class Registry(IRegistration, IRegistryService):
     Registers runners, stores, and assets. In a real system, runners
     and stores would be identified by a URL, and use the DNS to
     resolve. For now the registry helps with this.
+
+    Requests may come in concurrently from different server threads,
+    so access to the store is serialised using a lock.
     """
     def __init__(self) -> None:
         """Create a new registry."""
         self._asset_locations = dict()           # type: Dict[Identifier, str]
+        self._lock = Lock()
 
         archive = ReplicableArchive[RegisteredObject]()
         self._store = RegistryStore(archive, 0.1)
@@ -46,7 +51,8 @@ class Registry(IRegistration, IRegistryService):
         Return:
             An update from the given version to a newer version.
         """
-        return self._store.get_updates_since(from_version)
+        with self._lock:
+            return self._store.get_updates_since(from_version)
 
     def register_party(
             self, description: PartyDescription) -> None:
@@ -59,11 +65,12 @@ class Registry(IRegistration, IRegistryService):
             raise ValidationError(
                     'Invalid signature on PartyDescription object')
 
-        if self._in_store(PartyDescription, 'id', description.id):
-            raise RuntimeError(
-                    f'There is already a party called {description.id}')
+        with self._lock:
+            if self._in_store(PartyDescription, 'id', description.id):
+                raise RuntimeError(
+                        f'There is already a party called {description.id}')
 
-        self._store.insert(description)
+            self._store.insert(description)
         logger.info(f'Registered party {description}')
 
     def deregister_party(self, party_id: Identifier) -> None:
@@ -72,10 +79,11 @@ class Registry(IRegistration, IRegistryService):
         Args:
             party_id: Identifier of the party to deregister.
         """
-        description = self._get_object(PartyDescription, 'id', party_id)
-        if description is None:
-            raise KeyError('Party not found')
-        self._store.delete(description)
+        with self._lock:
+            description = self._get_object(PartyDescription, 'id', party_id)
+            if description is None:
+                raise KeyError('Party not found')
+            self._store.delete(description)
 
     def register_site(self, description: SiteDescription) -> None:
         """Register a Site with the Registry.
@@ -84,25 +92,26 @@ class Registry(IRegistration, IRegistryService):
             description: Description of the site.
 
         """
-        if self._in_store(SiteDescription, 'id', description.id):
-            raise RuntimeError(
-                    f'There is already a site called {description.id}')
-
-        owner = self._get_object(
-                PartyDescription, 'id', description.owner_id)
-        if owner is None:
-            raise RuntimeError(f'Party {description.owner_id} not found')
-
-        admin = self._get_object(
-                PartyDescription, 'id', description.admin_id)
-        if admin is None:
-            raise RuntimeError(f'Party {description.admin_id} not found')
-
-        if not description.has_valid_signature(admin.main_key()):
-            raise ValidationError(
-                    'Invalid signature on SiteDescription object')
-
-        self._store.insert(description)
+        with self._lock:
+            if self._in_store(SiteDescription, 'id', description.id):
+                raise RuntimeError(
+                        f'There is already a site called {description.id}')
+
+            owner = self._get_object(
+                    PartyDescription, 'id', description.owner_id)
+            if owner is None:
+                raise RuntimeError(f'Party {description.owner_id} not found')
+
+            admin = self._get_object(
+                    PartyDescription, 'id', description.admin_id)
+            if admin is None:
+                raise RuntimeError(f'Party {description.admin_id} not found')
+
+            if not description.has_valid_signature(admin.main_key()):
+                raise ValidationError(
+                        'Invalid signature on SiteDescription object')
+
+            self._store.insert(description)
         logger.info(f'{self} Registered site {description}')
 
     def deregister_site(self, site_id: Identifier) -> None:
@@ -111,10 +120,11 @@ class Registry(IRegistration, IRegistryService):
         Args:
             site_id: Identifer of the site to deregister.
         """
-        description = self._get_object(SiteDescription, 'id', site_id)
-        if description is None:
-            raise KeyError('Site not found')
-        self._store.delete(description)
+        with self._lock:
+            description = self._get_object(SiteDescription, 'id', site_id)
+            if description is None:
+                raise KeyError('Site not found')
+            self._store.delete(description)
 
     def _get_object(
             self, typ: Type[_ReplicatedClass], attr_name: str, value: Any
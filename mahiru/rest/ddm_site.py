@@ -3,20 +3,19 @@ from copy import copy
 from enum import Enum
 import logging
 from pathlib import Path
-from socketserver import ThreadingMixIn
 from tempfile import NamedTemporaryFile
 from threading import Thread
-from typing import Dict, List
+from typing import BinaryIO, Dict, List
 from urllib.parse import quote, unquote_to_bytes
-from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+from wsgiref.simple_server import WSGIRequestHandler
 
 from cryptography.hazmat.primitives.serialization import Encoding
 from cryptography import x509
 from cryptography.x509 import Certificate
 from cryptography.x509.oid import ExtensionOID
 from falcon import (
-        App, HTTP_200, HTTP_201, HTTP_204, HTTP_303, HTTP_400, HTTP_403,
-        HTTP_404, Request, Response)
+        App, HTTP_200, HTTP_201, HTTP_204, HTTP_206, HTTP_303, HTTP_400,
+        HTTP_403, HTTP_404, HTTP_416, Request, Response)
 from jsonschema import ValidationError
 import ruamel.yaml as yaml
 import yatiml
@@ -33,6 +32,7 @@ from mahiru.definitions.interfaces import IAssetStore, IStepRunner
 from mahiru.definitions.policy import Rule
 from mahiru.definitions.workflows import ExecutionRequest, Job
 from mahiru.policy.replication import PolicyStore
+from mahiru.rest.definitions import ThreadingWSGIServer, use_orjson
 from mahiru.rest.registry_client import RegistryRestClient
 from mahiru.rest.replication import ReplicationHandler
 from mahiru.rest.serialization import deserialize, serialize
@@ -134,7 +134,7 @@ class AccessController:
             requester: The claimed requester.
             client_cert: The client's HTTPS certificate.
         """
-        logger.info(f'Requester cert: {client_cert}')
+        logger.info('Requester cert: %s', client_cert)
         subj_alt_name_ext = client_cert.extensions.get_extension_for_oid(
                 ExtensionOID.SUBJECT_ALTERNATIVE_NAME)
         client_dns_names = subj_alt_name_ext.value.get_values_for_type(
@@ -143,18 +143,18 @@ class AccessController:
             raise RuntimeError(
                     'Client certificate has more than one subjAltName')
         client_domain = client_dns_names[0]
-        logger.debug(f'Client domain from certificate: {client_domain}')
+        logger.debug('Client domain from certificate: %s', client_domain)
 
         try:
             self._registry_client.update()
             site_desc = self._registry_client.get_site_by_id(requester)
         except Exception as e:
-            logger.error(f'Invalid requester {requester}: {e}')
+            logger.error('Invalid requester %s: %s', requester, e)
             raise RuntimeError('Invalid requester')
 
-        logger.debug(f'Site endpoint: {site_desc.endpoint}')
+        logger.debug('Site endpoint: %s', site_desc.endpoint)
         site_domain = site_desc.endpoint.split('://')[1]
-        logger.debug(f'Site domain from registry: {site_domain}')
+        logger.debug('Site domain from registry: %s', site_domain)
         if client_domain != site_domain:
             raise RuntimeError(
                     f'Request claims to be from {requester} which has domain'
@@ -195,13 +195,13 @@ class AccessController:
             RuntimeError: If there was a problem parsing the data.
         """
         lines = cert_bytes.decode('ascii').splitlines()
-        logger.debug(f'lines: {lines}')
+        logger.debug('lines: %s', lines)
         cert_list = list()      # type: List[List[str]]
         state = 'before cert'
         for line in lines:
-            logger.debug(f'cert list: {cert_list}')
-            logger.debug(f'state: "{state}"')
-            logger.debug(f'line: "{line}"')
+            logger.debug('cert list: %s', cert_list)
+            logger.debug('state: "%s"', state)
+            logger.debug('line: "%s"', line)
             if line.split() == []:      # skip whitespace only lines
                 continue
 
@@ -249,15 +249,15 @@ class AssetAccessHandler:
             asset_id: The id of the requested asset
 
         """
-        logger.info(f'Asset access request')
+        logger.info('Asset access request')
         if 'requester' not in request.params:
-            logger.info(f'Invalid asset access request')
+            logger.info('Invalid asset access request')
             response.status = HTTP_400
             response.body = 'Invalid request'
         else:
             logger.info(
-                    f'Received request for asset {asset_id} from'
-                    f' {request.params["requester"]}')
+                    'Received request for asset %s from %s', asset_id,
+                    request.params['requester'])
             try:
                 requester = Identifier(request.params['requester'])
                 client_cert_header = request.get_header('X-Client-Certificate')
@@ -274,11 +274,12 @@ class AssetAccessHandler:
                     asset.image_location = _request_url(request) + '/image'
 
                 logger.info(
-                        f'Sending with asset location {asset.image_location}')
+                        'Sending with asset location %s',
+                        asset.image_location)
                 response.status = HTTP_200
                 response.media = serialize(asset)
             except KeyError:
-                logger.info(f'Asset {asset_id} not found')
+                logger.info('Asset %s not found', asset_id)
                 response.status = HTTP_404
                 response.body = 'Asset not found'
             except RuntimeError:
@@ -286,12 +287,40 @@ class AssetAccessHandler:
                 # avoid information-leaking the existence of any
                 # particular assets.
                 logger.info(
-                        f'Asset {asset_id} not available for user'
-                        f' {request.params["requester"]}')
+                        'Asset %s not available for user %s', asset_id,
+                        request.params['requester'])
                 response.status = HTTP_404
                 response.body = 'Asset not found'
 
 
+class _FileRange:
+    """A readable stream covering part of a file."""
+    def __init__(self, stream: BinaryIO, start: int, length: int) -> None:
+        """Create a _FileRange.
+
+        Args:
+            stream: The file to read from. Will be closed with this
+                    object.
+            start: Offset of the first byte to read.
+            length: Number of bytes to read.
+        """
+        stream.seek(start)
+        self._stream = stream
+        self._remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        """Read at most size bytes, or all remaining if size < 0."""
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._stream.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        """Close the underlying file."""
+        self._stream.close()
+
+
 class AssetImageAccessHandler:
     """A handler for the external /assets/{assetId}/image endpoints."""
     def __init__(
@@ -316,9 +345,9 @@ class AssetImageAccessHandler:
             asset_id: The id of the requested asset
 
         """
-        logger.info(f'Asset image request, store = {self._store}')
+        logger.info('Asset image request, store = %s', self._store)
         if 'requester' not in request.params:
-            logger.info(f'Invalid asset access request')
+            logger.info('Invalid asset access request')
             response.status = HTTP_400
             response.body = 'Invalid request'
         else:
@@ -330,22 +359,21 @@ class AssetImageAccessHandler:
                 self._access_controller.check_requester(requester, client_cert)
 
             logger.info(
-                    f'Received request for asset {asset_id} from'
-                    f' {request.params["requester"]}')
+                    'Received request for asset %s from %s', asset_id,
+                    request.params['requester'])
             try:
                 asset = self._store.retrieve(
                         Identifier(asset_id), request.params['requester'])
                 if asset.image_location is None:
                     raise KeyError()
-                response.status = HTTP_200
                 response.content_type = 'application/x-tar'
-                logger.info(f'Reading image from {asset.image_location}')
+                response.accept_ranges = 'bytes'
+                logger.info('Reading image from %s', asset.image_location)
                 image_path = Path(asset.image_location)
                 image_size = image_path.stat().st_size
-                image_stream = image_path.open('rb')
-                response.set_stream(image_stream, image_size)
+                self._send_image(request, response, image_path, image_size)
             except KeyError:
-                logger.info(f'Asset {asset_id} not found')
+                logger.info('Asset %s not found', asset_id)
                 response.status = HTTP_404
                 response.body = 'Asset not found'
             except RuntimeError:
@@ -353,11 +381,47 @@ class AssetImageAccessHandler:
                 # avoid information-leaking the existence of any
                 # particular assets.
                 logger.info(
-                        f'Asset {asset_id} not available for user'
-                        f' {request.params["requester"]}')
+                        'Asset %s not available for user %s', asset_id,
+                        request.params['requester'])
                 response.status = HTTP_404
                 response.body = 'Asset not found'
 
+    def _send_image(
+            self, request: Request, response: Response, image_path: Path,
+            image_size: int) -> None:
+        """Send (part of) an image file.
+
+        This supports a single byte range in a Range header, so that
+        clients can download large images in parallel.
+
+        Args:
+            request: The submitted request.
+            response: A response object to configure.
+            image_path: The image file to send.
+            image_size: Size of the image file in bytes.
+        """
+        if request.range is None:
+            response.status = HTTP_200
+            response.set_stream(image_path.open('rb'), image_size)
+            return
+
+        start, end = request.range
+        if start < 0:
+            start = max(image_size + start, 0)
+        if end < 0 or end >= image_size:
+            end = image_size - 1
+
+        if start > end:
+            response.status = HTTP_416
+            response.set_header('Content-Range', f'bytes */{image_size}')
+            return
+
+        length = end - start + 1
+        response.status = HTTP_206
+        response.content_range = (start, end, image_size)
+        response.set_stream(
+                _FileRange(image_path.open('rb'), start, length), length)
+
 
 class AssetConnectionAccessHandler:
     """A handler for the /assets/{assetId}/connect endpoints."""
@@ -382,15 +446,15 @@ class AssetConnectionAccessHandler:
             response: A response object to configure.
             asset_id: The id of the requested asset
         """
-        logger.info(f'Asset connection request, store = {self._store}')
+        logger.info('Asset connection request, store = %s', self._store)
         try:
             if 'requester' not in request.params:
-                logger.info(f'Invalid asset access request')
+                logger.info('Invalid asset access request')
                 raise ValidationError('No requester specified')
             else:
                 logger.info(
-                        f'Received request to connect to asset {asset_id} from'
-                        f' {request.params["requester"]}')
+                        'Received request to connect to asset %s from %s',
+                        asset_id, request.params['requester'])
 
                 requester = Identifier(request.params['requester'])
                 client_cert_header = request.get_header('X-Client-Certificate')
@@ -410,7 +474,7 @@ class AssetConnectionAccessHandler:
                 response.status = HTTP_200
                 response.media = serialize(conn_info)
         except KeyError:
-            logger.info(f'Asset {asset_id} not found')
+            logger.info('Asset %s not found', asset_id)
             response.status = HTTP_404
             response.body = 'Asset not found'
         except RuntimeError:
@@ -418,8 +482,8 @@ class AssetConnectionAccessHandler:
             # avoid information-leaking the existence of any
             # particular assets.
             logger.info(
-                    f'Asset {asset_id} connection not available for user'
-                    f' {request.params["requester"]}')
+                    'Asset %s connection not available for user %s', asset_id,
+                    request.params['requester'])
             response.status = HTTP_404
             response.body = 'Asset not found'
         except ValueError:
@@ -456,10 +520,10 @@ class ConnectionsHandler:
             response: A response object to configure.
             conn_id: The id of the connection to remove.
         """
-        logger.info(f'Asset disconnection request, store = {self._store}')
+        logger.info('Asset disconnection request, store = %s', self._store)
         try:
             if 'requester' not in request.params:
-                logger.info(f'Invalid asset access request')
+                logger.info('Invalid asset access request')
                 raise ValidationError('No requester specified')
             else:
                 requester = Identifier(request.params['requester'])
@@ -471,19 +535,19 @@ class ConnectionsHandler:
                             requester, client_cert)
 
                 logger.info(
-                        f'Received request to disconnect connection {conn_id}'
-                        f' from {request.params["requester"]}')
+                        'Received request to disconnect connection %s from %s',
+                        conn_id, request.params['requester'])
 
                 self._store.stop_serving(conn_id, request.params['requester'])
                 response.status = HTTP_200
         except KeyError:
-            logger.info(f'Connection {conn_id} not found')
+            logger.info('Connection %s not found', conn_id)
             response.status = HTTP_404
             response.body = 'Connection not found'
         except RuntimeError:
             logger.info(
-                    f'Connection {conn_id} not owned by user'
-                    f' {request.params["requester"]}')
+                    'Connection %s not owned by user %s', conn_id,
+                    request.params['requester'])
             response.status = HTTP_403
             response.body = 'Connection not yours'
         # TODO: return 503 when connections are disabled altogether
@@ -513,7 +577,7 @@ class AssetManagementHandler:
 
         """
         try:
-            logger.info(f'Asset storage request')
+            logger.info('Asset storage request')
             client_cert_header = request.get_header('X-Client-Certificate')
             if client_cert_header:
                 self._access_controller.check_user_authorization(
@@ -521,12 +585,12 @@ class AssetManagementHandler:
                         InternalOperation.MANAGE_ASSETS)
             validate_json('Asset', request.media)
             asset = deserialize(Asset, request.media)
-            logger.info(f'Storing asset {asset}')
+            logger.info('Storing asset %s', asset)
             self._store.store(asset)
             response.status = HTTP_201
             response.body = 'Created'
         except ValidationError:
-            logger.warning(f'Invalid asset storage request: {request.media}')
+            logger.warning('Invalid asset storage request: %s', request.media)
             response.status = HTTP_400
             response.body = 'Invalid request'
 
@@ -568,7 +632,7 @@ class AssetImageManagementHandler:
         try:
             asset_id = Identifier(asset_id)
         except ValueError:
-            logger.warning(f'Invalid asset image storage request')
+            logger.warning('Invalid asset image storage request')
             response.status = HTTP_400
             response.body = 'Invalid asset id'
             return
@@ -586,7 +650,7 @@ class AssetImageManagementHandler:
             response.status = HTTP_201
             response.body = 'Created'
         except KeyError:
-            logger.warning(f'Image storage requested for unknown asset')
+            logger.warning('Image storage requested for unknown asset')
             response.status = HTTP_404
             response.body = 'Unknown asset id'
 
@@ -607,7 +671,10 @@ class PolicyManagementHandler:
         self._policy_store = policy_store
 
     def on_post(self, request: Request, response: Response) -> None:
-        """Handle request to add a rule.
+        """Handle request to add a rule, or a list of rules.
+
+        If a list is submitted, then either all rules are added or, if
+        any of them is invalid, none.
 
         Args:
             request: The submitted request.
@@ -621,13 +688,19 @@ class PolicyManagementHandler:
                         unquote_to_bytes(client_cert_header),
                         InternalOperation.MANAGE_POLICIES)
 
-            validate_json('Rule', request.media)
-            rule = deserialize(Rule, request.media)
-            self._policy_store.insert(rule)
+            rules_json = request.media
+            if not isinstance(rules_json, list):
+                rules_json = [rules_json]
+
+            for rule_json in rules_json:
+                validate_json('Rule', rule_json)
+            rules = [deserialize(Rule, rule_json) for rule_json in rules_json]
+            for rule in rules:
+                self._policy_store.insert(rule)
             response.status = HTTP_201
             response.body = 'Created'
         except ValidationError:
-            logger.warning(f'Invalid rule submitted: {request.media}')
+            logger.warning('Invalid rule submitted: %s', request.media)
             response.status = HTTP_400
             response.body = 'Invalid request'
 
@@ -651,14 +724,14 @@ class WorkflowExecutionHandler:
 
         """
         try:
-            logger.info(f'Received execution request: {request.media}')
+            logger.info('Received execution request: %s', request.media)
             validate_json('ExecutionRequest', request.media)
             request = deserialize(ExecutionRequest, request.media)
             self._runner.execute_request(request)
             response.status = HTTP_201
             response.body = 'Created'
         except ValidationError:
-            logger.warning(f'Invalid execution request: {request.media}')
+            logger.warning('Invalid execution request: %s', request.media)
             response.status = HTTP_400
             response.body = 'Invalid request'
 
@@ -695,7 +768,7 @@ class WorkflowSubmissionHandler:
         if (
                 'requesting_party' not in request.params or
                 'requesting_site' not in request.params):
-            logger.info(f'Invalid job submission')
+            logger.info('Invalid job submission')
             response.status = HTTP_400
             response.body = 'Invalid request'
             return
@@ -712,15 +785,15 @@ class WorkflowSubmissionHandler:
             validate_json('Job', request.media)
             job = deserialize(Job, request.media)
             logger.info(
-                    f'Received new job {request.media} from'
-                    f' {requesting_party}')
+                    'Received new job %s from %s', request.media,
+                    requesting_party)
             job_id = self._orchestrator.start_job(
                     requesting_party, requesting_site, job)
-            logger.info(f'Created new job {job_id} for {requesting_party}')
+            logger.info('Created new job %s for %s', job_id, requesting_party)
             response.status = HTTP_303
             response.location = _request_url(request) + '/' + job_id
         except ValidationError:
-            logger.warning(f'Invalid execution request: {request.media}')
+            logger.warning('Invalid execution request: %s', request.media)
             response.status = HTTP_400
             response.body = 'Invalid request'
 
@@ -756,7 +829,7 @@ class WorkflowStatusHandler:
             job_id: The orchestrator job id.
 
         """
-        logger.debug(f'Handling request for status of job {job_id}')
+        logger.debug('Handling request for status of job %s', job_id)
 
         client_cert_header = request.get_header('X-Client-Certificate')
         if client_cert_header:
@@ -768,7 +841,7 @@ class WorkflowStatusHandler:
             plan = self._orchestrator.get_plan(job_id)
             is_done = self._orchestrator.is_done(job_id)
         except KeyError:
-            logger.warning(f'Request for non-existent job {job_id}')
+            logger.warning('Request for non-existent job %s', job_id)
             response.status = HTTP_404
             response.body = 'Job not found'
             return
@@ -808,6 +881,7 @@ class SiteRestApi:
 
         """
         self.app = App()
+        use_orjson(self.app)
 
         rule_replication = ReplicationHandler[Rule](policy_store)
         self.app.add_route('/external/rules/updates', rule_replication)
@@ -855,11 +929,6 @@ class SiteRestApi:
         self.app.add_route('/internal/jobs', workflow_submission)
 
 
-class ThreadingWSGIServer (ThreadingMixIn, WSGIServer):
-    """Threading version of a simple WSGI server."""
-    pass
-
-
 class SiteServer:
     """An HTTP server serving a SiteRestApi.
 
@@ -890,12 +959,12 @@ class SiteServer:
         self.external_endpoint = (
                 f'http://{self._server.server_name}'
                 f':{self._server.server_port}/external')
-        logger.info(f'Site server listening on {self.external_endpoint}')
+        logger.info('Site server listening on %s', self.external_endpoint)
 
         self.internal_endpoint = (
                 f'http://{self._server.server_name}'
                 f':{self._server.server_port}/internal')
-        logger.info(f'Site server listening on {self.internal_endpoint}')
+        logger.info('Site server listening on %s', self.internal_endpoint)
 
     def close(self) -> None:
         """Stop the server thread."""
@@ -912,7 +981,7 @@ def wsgi_app() -> App:
 
     registry_rest_client = RegistryRestClient(
             settings.registry_endpoint, settings.trust_store,
-            settings.client_creds())
+            settings.client_creds(), settings.registry_cache_dir)
     registry_client = RegistryClient(registry_rest_client)
     access_controller = AccessController(registry_client, settings.owner)
     site = Site(settings, [], [], registry_client)
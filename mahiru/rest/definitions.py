@@ -1,5 +1,31 @@
 """General definitions for REST APIs."""
+from socketserver import ThreadingMixIn
 from typing import Any, Dict
+from wsgiref.simple_server import WSGIServer
+
+from falcon import App, MEDIA_JSON
+from falcon.media import JSONHandler
+import orjson
 
 
 JSON = Dict[str, Any]
+
+
+JSON_HEADERS = {'Content-Type': MEDIA_JSON}
+"""Headers to send with a request with an orjson-encoded body."""
+
+
+def use_orjson(app: App) -> None:
+    """Make a Falcon app use orjson for JSON requests and responses.
+
+    Args:
+        app: The app to configure.
+    """
+    handler = JSONHandler(dumps=orjson.dumps, loads=orjson.loads)
+    app.req_options.media_handlers[MEDIA_JSON] = handler
+    app.resp_options.media_handlers[MEDIA_JSON] = handler
+
+
+class ThreadingWSGIServer (ThreadingMixIn, WSGIServer):
+    """Threading version of a simple WSGI server."""
+    pass
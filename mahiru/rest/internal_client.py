@@ -1,17 +1,21 @@
 """Client for internal REST APIs."""
-from copy import copy
+from concurrent.futures import Future
 from pathlib import Path
+import re
+from threading import Lock
 from urllib.parse import quote, urlparse
 import time
-from typing import Optional, Tuple, Union
+from typing import Dict, Iterable, Optional, Pattern, Tuple
 
-import requests
+import orjson
 
 from mahiru.definitions.assets import Asset
 from mahiru.definitions.execution import JobResult
 from mahiru.definitions.policy import Rule
 from mahiru.definitions.workflows import Job
+from mahiru.rest.definitions import JSON_HEADERS
 from mahiru.rest.serialization import deserialize, serialize
+from mahiru.rest.session import create_session
 from mahiru.rest.validation import validate_json
 
 
@@ -21,6 +25,44 @@ _JOB_RESULT_WAIT_TIME = 0.5     # seconds
 _STANDARD_PORTS = {'http': 80, 'https': 443}
 
 
+def _job_uri_regex(jobs_url: str) -> Pattern[str]:
+    """Make a regex matching the URIs of jobs in a collection.
+
+    The port in the URI may be omitted or given explicitly if it's
+    the standard port for the scheme, both will match. The scheme and
+    host are matched case-insensitively.
+
+    Args:
+        jobs_url: URL of the jobs collection.
+
+    Returns:
+        A compiled regular expression.
+    """
+    parts = urlparse(jobs_url)
+    scheme = parts.scheme.lower()
+    port = parts.port
+    if port is None:
+        port = _STANDARD_PORTS.get(scheme)
+
+    if port == _STANDARD_PORTS.get(scheme):
+        port_re = f'(?::{port})?'
+    else:
+        port_re = f':{port}'
+
+    # Not parts.hostname, which is lower-cased and loses the brackets
+    # around IPv6 addresses
+    host = parts.netloc.rpartition('@')[2]
+    if host.startswith('['):
+        host = host[:host.index(']') + 1]
+    else:
+        host = host.partition(':')[0]
+
+    # Scheme and host are case-insensitive, the path is not
+    return re.compile(
+            f'(?i:{re.escape(scheme)}://{re.escape(host)}){port_re}'
+            f'{re.escape(parts.path)}/' r'[A-Za-z0-9_-]+\Z')
+
+
 class InternalSiteRestClient:
     """Handles connections to a local site."""
     def __init__(
@@ -40,19 +82,17 @@ class InternalSiteRestClient:
         """
         self._party = party
         self._site = site
-        self._endpoint = endpoint
 
-        # Convert trust store to argument for verify option of requests
-        if trust_store:
-            self._verify = str(trust_store)     # type: Union[str, bool]
-        else:
-            self._verify = True
+        self._assets_url = f'{endpoint}/assets'
+        self._rules_url = f'{endpoint}/rules'
+        self._jobs_url = f'{endpoint}/jobs'
+        self._job_uri_regex = _job_uri_regex(self._jobs_url)
 
-        if not client_credentials:
-            self._creds = None  # type: Optional[Tuple[str, str]]
-        else:
-            self._creds = (
-                    str(client_credentials[0]), str(client_credentials[1]))
+        self._session = create_session(trust_store, client_credentials)
+
+        # Results being waited for by get_job_result(), by job id
+        self._pending_results = dict()  # type: Dict[str, Future[JobResult]]
+        self._pending_results_lock = Lock()
 
     def store_asset(self, asset: Asset) -> None:
         """Stores an asset in the site's asset store.
@@ -61,23 +101,24 @@ class InternalSiteRestClient:
             asset: The asset to store.
 
         """
-        stripped_asset = copy(asset)
-        stripped_asset.image_location = None
+        asset_json = serialize(asset)
+        asset_json['image_location'] = None
 
-        r = requests.post(
-                f'{self._endpoint}/assets', json=serialize(stripped_asset),
-                verify=self._verify, cert=self._creds)
+        r = self._session.post(
+                self._assets_url, data=orjson.dumps(asset_json),
+                headers=JSON_HEADERS)
         if r.status_code != 201:
             raise RuntimeError(
                     f'Error uploading asset to site: {r.status_code}')
 
         if asset.image_location is not None:
+            safe_asset_id = quote(asset.id, safe='')
             with Path(asset.image_location).open('rb') as f:
-                r = requests.put(
-                        f'{self._endpoint}/assets/{quote(asset.id)}/image',
+                r = self._session.put(
+                        f'{self._assets_url}/{safe_asset_id}/image',
                         headers={
                             'Content-Type': 'application/octet-stream'},
-                        data=f, verify=self._verify, cert=self._creds)
+                        data=f)
                 if r.status_code != 201:
                     raise RuntimeError('Error uploading asset image to site')
 
@@ -88,12 +129,29 @@ class InternalSiteRestClient:
             rule: The rule to add.
 
         """
-        r = requests.post(
-                f'{self._endpoint}/rules', json=serialize(rule),
-                verify=self._verify, cert=self._creds)
+        r = self._session.post(
+                self._rules_url, data=orjson.dumps(serialize(rule)),
+                headers=JSON_HEADERS)
         if r.status_code != 201:
             raise RuntimeError(f'Error adding rule to site: {r.text}')
 
+    def add_rules(self, rules: Iterable[Rule]) -> None:
+        """Adds rules to the site's policy store in a single request.
+
+        This needs a site that accepts lists of rules, use add_rule()
+        to talk to older sites.
+
+        Args:
+            rules: The rules to add.
+
+        """
+        r = self._session.post(
+                self._rules_url,
+                data=orjson.dumps([serialize(rule) for rule in rules]),
+                headers=JSON_HEADERS)
+        if r.status_code != 201:
+            raise RuntimeError(f'Error adding rules to site: {r.text}')
+
     def submit_job(self, job: Job) -> str:
         """Submits a job to the DDM via the local site.
 
@@ -104,12 +162,12 @@ class InternalSiteRestClient:
             The new job's id.
 
         """
-        r = requests.post(
-                f'{self._endpoint}/jobs', json=serialize(job),
-                params={
+        r = self._session.post(
+                self._jobs_url, data=orjson.dumps(serialize(job)),
+                headers=JSON_HEADERS, params={
                     'requesting_site': self._site,
                     'requesting_party': self._party},
-                allow_redirects=False, verify=self._verify, cert=self._creds)
+                allow_redirects=False)
         if r.status_code != 303:
             raise RuntimeError(f'Error submitting job: {r.text}')
         if 'location' not in r.headers:
@@ -117,22 +175,7 @@ class InternalSiteRestClient:
 
         # Protect against malicious servers redirecting us elsewhere
         job_uri = r.headers['location']
-        job_uri_parts = urlparse(job_uri)
-        job_uri_port = job_uri_parts.port
-        if job_uri_port is None:
-            job_uri_port = _STANDARD_PORTS.get(job_uri_parts.scheme)
-
-        prefix = f'{self._endpoint}/jobs/'
-        prefix_parts = urlparse(prefix)
-        prefix_port = prefix_parts.port
-        if prefix_port is None:
-            prefix_port = _STANDARD_PORTS.get(prefix_parts.scheme)
-
-        if (
-                job_uri_parts.scheme != prefix_parts.scheme or
-                job_uri_parts.netloc != prefix_parts.netloc or
-                not job_uri_parts.path.startswith(prefix_parts.path) or
-                job_uri_port != prefix_port):
+        if not self._job_uri_regex.match(job_uri):
             raise RuntimeError(
                      f'Unexpected server response {job_uri} when'
                      ' submitting job')
@@ -155,7 +198,9 @@ class InternalSiteRestClient:
     def get_job_result(self, job_id: str) -> JobResult:
         """Gets the results of a submitted job.
 
-        This waits until the job is done before returning.
+        This waits until the job is done before returning. If several
+        threads wait for the same job at the same time, then only one
+        of them polls the server, and the others get its result.
 
         Args:
             job_id: The job's id from :func:`submit_job`.
@@ -168,19 +213,38 @@ class InternalSiteRestClient:
             RuntimeError: If there was an error communicating with the
                     server.
         """
-        while True:
-            result = self._get_job_result(job_id)
-            if result.is_done:
-                break
-            time.sleep(_JOB_RESULT_WAIT_TIME)
-        return result
+        with self._pending_results_lock:
+            future = self._pending_results.get(job_id)
+            if future is None:
+                future = Future()
+                self._pending_results[job_id] = future
+                is_poller = True
+            else:
+                is_poller = False
+
+        if is_poller:
+            try:
+                while True:
+                    result = self._get_job_result(job_id)
+                    if result.is_done:
+                        break
+                    time.sleep(_JOB_RESULT_WAIT_TIME)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._pending_results_lock:
+                    del self._pending_results[job_id]
+
+        return future.result()
 
     def _get_job_result(self, job_id: str) -> JobResult:
         """Gets the job's current result from the server."""
-        r = requests.get(job_id, verify=self._verify, cert=self._creds)
+        r = self._session.get(job_id)
         if r.status_code == 404:
             raise KeyError('Job not found')
         if r.status_code != 200:
             raise RuntimeError(f'Error getting job status: {r.text}')
-        validate_json('JobResult', r.json())
-        return deserialize(JobResult, r.json())
+        result_json = orjson.loads(r.content)
+        validate_json('JobResult', result_json)
+        return deserialize(JobResult, result_json)
@@ -1,6 +1,5 @@
 """REST-style API for central registry."""
 import logging
-from pathlib import Path
 from threading import Thread
 from typing import Type
 from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
@@ -8,7 +7,6 @@ from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
 from falcon import (
         App, HTTP_200, HTTP_201, HTTP_400, HTTP_404, HTTP_409, Request,
         Response)
-import ruamel.yaml as yaml
 
 from mahiru.definitions.errors import ValidationError
 from mahiru.definitions.identifier import Identifier
@@ -16,6 +14,7 @@ from mahiru.definitions.interfaces import IRegistration
 from mahiru.definitions.registry import (
         PartyDescription, RegisteredObject, SiteDescription)
 from mahiru.registry.registry import Registry
+from mahiru.rest.definitions import ThreadingWSGIServer, use_orjson
 from mahiru.rest.replication import ReplicationHandler
 from mahiru.rest.serialization import deserialize
 from mahiru.rest.validation import validate_json
@@ -39,15 +38,26 @@ class PartyRegistrationHandler:
     def on_post(self, request: Request, response: Response) -> None:
         """Handle a party registration request.
 
+        The request may contain a single party description or a list
+        of them. All descriptions are validated before any of them is
+        registered. If registration fails part way through, then the
+        descriptions before the failing one remain registered.
+
         Args:
             request: The submitted request.
             response: A response object to configure.
 
         """
         try:
-            validate_json('Party', request.media)
-            self._registry.register_party(
-                    deserialize(PartyDescription, request.media))
+            descs_json = request.media
+            if not isinstance(descs_json, list):
+                descs_json = [descs_json]
+
+            for desc_json in descs_json:
+                validate_json('Party', desc_json)
+            descs = [deserialize(PartyDescription, d) for d in descs_json]
+            for desc in descs:
+                self._registry.register_party(desc)
             response.status = HTTP_201
             response.body = 'Created'
         except ValidationError as e:
@@ -92,15 +102,26 @@ class SiteRegistrationHandler:
     def on_post(self, request: Request, response: Response) -> None:
         """Handle a site registration request.
 
+        The request may contain a single site description or a list
+        of them. All descriptions are validated before any of them is
+        registered. If registration fails part way through, then the
+        descriptions before the failing one remain registered.
+
         Args:
             request: The submitted request.
             response: A response object to configure.
 
         """
         try:
-            validate_json('Site', request.media)
-            self._registry.register_site(
-                    deserialize(SiteDescription, request.media))
+            descs_json = request.media
+            if not isinstance(descs_json, list):
+                descs_json = [descs_json]
+
+            for desc_json in descs_json:
+                validate_json('Site', desc_json)
+            descs = [deserialize(SiteDescription, d) for d in descs_json]
+            for desc in descs:
+                self._registry.register_site(desc)
             response.status = HTTP_201
             response.body = 'Created'
         except ValidationError as e:
@@ -147,10 +168,7 @@ class RegistryRestApi:
 
         """
         self.app = App()
-
-        registry_api_file = Path(__file__).parent / 'registry_api.yaml'
-        with open(registry_api_file, 'r') as f:
-            registry_api_def = yaml.safe_load(f.read())
+        use_orjson(self.app)
 
         party_registration = PartyRegistrationHandler(registry)
         self.app.add_route('/parties', party_registration)
@@ -168,12 +186,14 @@ class RegistryServer:
     """An HTTP server serving the registry API."""
     def __init__(
             self, api: RegistryRestApi,
-            server_type: Type[WSGIServer] = WSGIServer
+            server_type: Type[WSGIServer] = ThreadingWSGIServer
             ) -> None:
         """Create a RegistryServer.
 
         This starts a background thread with an HTTP server. It will
-        listen on all local interfaces on port 4413.
+        listen on all local interfaces on port 4413. By default, each
+        request is handled in a thread of its own, so that slow
+        requests do not hold up others.
 
         Args:
             api: The API to serve.
@@ -1,28 +1,49 @@
 """Client for the registry REST API."""
+import logging
+import os
 from pathlib import Path
-from typing import cast, Optional, Tuple, Union
+from typing import cast, Iterable, Optional, Tuple
 
-import requests
-import ruamel.yaml as yaml
+import orjson
 
+from mahiru.__version__ import __version__
+from mahiru.definitions.errors import ValidationError
 from mahiru.definitions.identifier import Identifier
 from mahiru.definitions.interfaces import (
         IRegistration, IRegistryService, IReplicaUpdate)
 from mahiru.definitions.registry import (
         PartyDescription, RegisteredObject, SiteDescription)
-from mahiru.rest.replication import ReplicationRestClient
 from mahiru.registry.replication import RegistryUpdate
-from mahiru.rest.serialization import serialize
+from mahiru.replication import ReplicaUpdate
+from mahiru.rest.definitions import JSON_HEADERS
+from mahiru.rest.replication import ReplicationRestClient
+from mahiru.rest.serialization import deserialize, serialize
+from mahiru.rest.session import create_session
+from mahiru.rest.validation import validate_json
+
+
+logger = logging.getLogger(__name__)
+
+
+# Cached update from version 0, and the epoch of the registry it is from
+_Cache = Tuple[Optional[ReplicaUpdate[RegisteredObject]], Optional[str]]
 
 
 class RegistryRestClient(ReplicationRestClient[RegisteredObject]):
-    """A replication client for replicating the registry."""
+    """A replication client for replicating the registry.
+
+    If given a cache directory, this client keeps a copy of the
+    registry contents on disk. A fresh replica, e.g. one created after
+    a restart, is then sent the cached contents plus whatever changed
+    since, rather than downloading the whole registry again.
+    """
     UpdateType = RegistryUpdate
 
     def __init__(
             self, endpoint: str = 'http://localhost:4413',
             trust_store: Optional[Path] = None,
-            client_credentials: Optional[Tuple[Path, Path]] = None
+            client_credentials: Optional[Tuple[Path, Path]] = None,
+            cache_dir: Optional[Path] = None
             ) -> None:
         """Create a RegistryRestClient.
 
@@ -31,10 +52,136 @@ class RegistryRestClient(ReplicationRestClient[RegisteredObject]):
             trust_store: A file with trusted certificates/anchors.
             client_credentials: Paths to PEM files with the HTTPS
                     client certificate and key to use when connecting.
+            cache_dir: Directory to cache the registry contents in,
+                    or None to not cache them.
         """
         super().__init__(
                 endpoint + '/updates', trust_store, client_credentials)
 
+        self._cache_file = None     # type: Optional[Path]
+        self._cache = None  # type: Optional[ReplicaUpdate[RegisteredObject]]
+        self._cache_epoch = None    # type: Optional[str]
+        if cache_dir is not None:
+            self._cache_file = cache_dir / 'registry_cache.json'
+            self._cache, self._cache_epoch = self._load_cache()
+
+    def get_updates_since(
+            self, from_version: Optional[int]
+            ) -> ReplicaUpdate[RegisteredObject]:
+        """Get updates since the given version.
+
+        Args:
+            from_version: Version to start at, None to get all updates.
+        """
+        if self._cache_file is None:
+            return super().get_updates_since(from_version)
+
+        if not from_version and self._cache is not None:
+            update, epoch = self._get_updates(self._cache.to_version)
+            if epoch is None or epoch != self._cache_epoch:
+                # The registry restarted, so its versions do not
+                # match ours even if the numbers do.
+                logger.info('Registry was restarted, discarding cache')
+                self._cache = None
+                update, epoch = self._get_updates(from_version)
+            else:
+                update = self._apply(self._cache, update)
+        else:
+            update, epoch = self._get_updates(from_version)
+
+        if epoch is None:
+            # Can't tell whether the registry restarted, so don't cache
+            return update
+
+        if update.from_version == 0:
+            new_cache = update
+        elif (
+                self._cache is not None and epoch == self._cache_epoch and
+                update.from_version == self._cache.to_version):
+            new_cache = self._apply(self._cache, update)
+        else:
+            return update
+
+        if (
+                self._cache is None or epoch != self._cache_epoch or
+                new_cache.to_version != self._cache.to_version):
+            self._save_cache(new_cache, epoch)
+        self._cache = new_cache
+        self._cache_epoch = epoch
+        return update
+
+    def _apply(
+            self, full: ReplicaUpdate[RegisteredObject],
+            update: ReplicaUpdate[RegisteredObject]
+            ) -> ReplicaUpdate[RegisteredObject]:
+        """Apply an update to a full update from version 0.
+
+        Args:
+            full: An update from version 0 to some version.
+            update: An update from that version to a newer one.
+
+        Returns:
+            An update from version 0 to the newer version.
+        """
+        return self.UpdateType(
+                0, update.to_version, update.valid_until,
+                (full.created - update.deleted) | update.created, set())
+
+    def _load_cache(self) -> _Cache:
+        """Load cached registry contents from disk, if available.
+
+        Returns:
+            The cached update from version 0, and the epoch of the
+            registry it came from, or None and None if there is no
+            valid cache.
+        """
+        if self._cache_file is None or not self._cache_file.exists():
+            return None, None
+
+        try:
+            cache_json = orjson.loads(self._cache_file.read_bytes())
+            if (
+                    cache_json.get('mahiru_version') != __version__ or
+                    cache_json.get('endpoint') != self._endpoint or
+                    not isinstance(cache_json.get('epoch'), str)):
+                return None, None
+            validate_json('RegistryUpdate', cache_json['update'])
+            return (
+                    deserialize(RegistryUpdate, cache_json['update']),
+                    cache_json['epoch'])
+        except (OSError, ValueError, KeyError, ValidationError) as e:
+            logger.warning(
+                    'Ignoring invalid registry cache %s: %s',
+                    self._cache_file, e)
+            return None, None
+
+    def _save_cache(
+            self, full: ReplicaUpdate[RegisteredObject], epoch: str
+            ) -> None:
+        """Save registry contents to disk.
+
+        Args:
+            full: An update from version 0 to the current version.
+            epoch: Id of the registry instance it came from.
+        """
+        if self._cache_file is None:
+            return
+
+        cache_json = {
+                'mahiru_version': __version__,
+                'endpoint': self._endpoint,
+                'epoch': epoch,
+                'update': serialize(full)}
+
+        tmp_file = self._cache_file.with_suffix('.tmp')
+        try:
+            tmp_file.write_bytes(orjson.dumps(cache_json))
+            os.replace(tmp_file, self._cache_file)
+        except OSError as e:
+            logger.warning(
+                    'Could not write registry cache %s: %s',
+                    self._cache_file, e)
+
 
 class RegistrationRestClient(IRegistration):
     """REST client for registering sites and parties.
@@ -48,17 +195,9 @@ class RegistrationRestClient(IRegistration):
             client_credentials: Optional[Tuple[Path, Path]] = None
             ) -> None:
         """Create a RegistrationRestClient."""
-        self._registry_endpoint = endpoint
-        if trust_store:
-            self._verify = str(trust_store)     # type: Union[str, bool]
-        else:
-            self._verify = True
-
-        if not client_credentials:
-            self._creds = None  # type: Optional[Tuple[str, str]]
-        else:
-            self._creds = (
-                    str(client_credentials[0]), str(client_credentials[1]))
+        self._parties_url = f'{endpoint}/parties'
+        self._sites_url = f'{endpoint}/sites'
+        self._session = create_session(trust_store, client_credentials)
 
     def register_party(self, description: PartyDescription) -> None:
         """Register a party with the Registry.
@@ -67,10 +206,25 @@ class RegistrationRestClient(IRegistration):
             description: Description of the party.
 
         """
-        requests.post(
-                self._registry_endpoint + '/parties',
-                json=serialize(description), verify=self._verify,
-                cert=self._creds)
+        self._session.post(
+                self._parties_url, data=orjson.dumps(serialize(description)),
+                headers=JSON_HEADERS)
+
+    def register_parties(
+            self, descriptions: Iterable[PartyDescription]) -> None:
+        """Register several parties with the Registry in one request.
+
+        This needs a registry that accepts lists of parties, use
+        register_party() to talk to older registries.
+
+        Args:
+            descriptions: Descriptions of the parties.
+
+        """
+        self._session.post(
+                self._parties_url,
+                data=orjson.dumps([serialize(d) for d in descriptions]),
+                headers=JSON_HEADERS)
 
     def deregister_party(self, party: Identifier) -> None:
         """Deregister a party with the Registry.
@@ -79,9 +233,7 @@ class RegistrationRestClient(IRegistration):
             party: The party to deregister.
 
         """
-        r = requests.delete(
-                f'{self._registry_endpoint}/parties/{party}',
-                verify=self._verify, cert=self._creds)
+        r = self._session.delete(f'{self._parties_url}/{party}')
 
         if r.status_code == 404:
             raise KeyError('Party not found')
@@ -93,10 +245,25 @@ class RegistrationRestClient(IRegistration):
             description: Description of the site.
 
         """
-        requests.post(
-                self._registry_endpoint + '/sites',
-                json=serialize(description), verify=self._verify,
-                cert=self._creds)
+        self._session.post(
+                self._sites_url, data=orjson.dumps(serialize(description)),
+                headers=JSON_HEADERS)
+
+    def register_sites(
+            self, descriptions: Iterable[SiteDescription]) -> None:
+        """Register several sites with the Registry in one request.
+
+        This needs a registry that accepts lists of sites, use
+        register_site() to talk to older registries.
+
+        Args:
+            descriptions: Descriptions of the sites.
+
+        """
+        self._session.post(
+                self._sites_url,
+                data=orjson.dumps([serialize(d) for d in descriptions]),
+                headers=JSON_HEADERS)
 
     def deregister_site(self, site: Identifier) -> None:
         """Deregister a site with the Registry.
@@ -105,8 +272,6 @@ class RegistrationRestClient(IRegistration):
             site: The site to deregister.
 
         """
-        r = requests.delete(
-                f'{self._registry_endpoint}/sites/{site}',
-                verify=self._verify, cert=self._creds)
+        r = self._session.delete(f'{self._sites_url}/{site}')
         if r.status_code == 404:
             raise KeyError('Site not found')
@@ -1,12 +1,17 @@
 """REST API handlers/clients for the replication system."""
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+import gzip
 import logging
 from pathlib import Path
+import random
 import requests
-from typing import Dict, Generic, Optional, Tuple, Type, TypeVar, Union
+import secrets
+from typing import Dict, Generic, Optional, Tuple, Type, TypeVar
 
-from falcon import Request, Response
-from retrying import retry
+from falcon import HTTP_304, MEDIA_JSON, Request, Response
+import orjson
+from urllib3.util.retry import Retry
 
 from mahiru.definitions.interfaces import IReplicationService
 from mahiru.definitions.registry import RegisteredObject
@@ -15,6 +20,7 @@ from mahiru.policy.replication import PolicyUpdate
 from mahiru.registry.replication import RegistryUpdate
 from mahiru.replication import ReplicaUpdate
 from mahiru.rest.serialization import serialize, deserialize
+from mahiru.rest.session import create_session
 from mahiru.rest.validation import validate_json
 
 
@@ -24,9 +30,50 @@ logger = logging.getLogger(__name__)
 T = TypeVar('T')
 
 
-def _retry_on_connection_error(exception: BaseException) -> bool:
-    """Helper for retrying connections."""
-    return isinstance(exception, requests.ConnectionError)
+_RETRY_JITTER = 0.5     # seconds
+
+_GZIP_MIN_SIZE = 1024   # bytes
+
+
+EPOCH_HEADER = 'X-Replica-Epoch'
+"""Header identifying the server instance an update came from."""
+
+
+class _JitteredRetry(Retry):
+    """A urllib3 retry policy which adds random jitter to the backoff.
+
+    This keeps many clients polling the same server from retrying in
+    lockstep after an outage.
+    """
+    def get_backoff_time(self) -> float:
+        """Return the time to sleep before the next attempt."""
+        return super().get_backoff_time() + random.uniform(0, _RETRY_JITTER)
+
+
+def _accepts_gzip(request: Request) -> bool:
+    """Check whether the client accepts a gzip-encoded response."""
+    accept_encoding = request.get_header('Accept-Encoding', default='')
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() == 'gzip':
+            return params.replace(' ', '') not in ('q=0', 'q=0.0')
+    return False
+
+
+def _expiry_time(response: requests.Response) -> datetime:
+    """Get the expiry time of a response as a local time.
+
+    If the response does not have a valid Expires header, it is taken
+    to have expired already.
+    """
+    expires = response.headers.get('Expires')
+    if expires is not None:
+        try:
+            expiry_time = parsedate_to_datetime(expires)
+            return expiry_time.astimezone().replace(tzinfo=None)
+        except (TypeError, ValueError):
+            pass
+    return datetime.now()
 
 
 class ReplicationHandler(Generic[T]):
@@ -38,6 +85,10 @@ class ReplicationHandler(Generic[T]):
             service: The service to get updates from.
         """
         self._service = service
+        # Versions restart at zero when the service is recreated, so
+        # clients that keep updates around need to know which
+        # instance they came from.
+        self._epoch = secrets.token_hex(8)
 
     def on_get(self, request: Request, response: Response) -> None:
         """Handle a registry update request.
@@ -50,7 +101,29 @@ class ReplicationHandler(Generic[T]):
                 'from_version', required=True)
 
         updates = self._service.get_updates_since(from_version)
-        response.media = serialize(updates)
+
+        # If the client is up to date, tell it so without sending an
+        # (empty) update. It can make one itself, using the expiry
+        # time to set the validity.
+        response.etag = str(updates.to_version)
+        response.set_header(EPOCH_HEADER, self._epoch)
+        response.expires = updates.valid_until.astimezone(timezone.utc)
+        if updates.to_version == from_version:
+            if str(from_version) in (request.if_none_match or []):
+                response.status = HTTP_304
+                return
+
+        data = orjson.dumps(serialize(updates))
+
+        # Updates are repetitive and compress well, but don't bother
+        # for tiny ones.
+        response.vary = ('Accept-Encoding',)
+        if len(data) >= _GZIP_MIN_SIZE and _accepts_gzip(request):
+            data = gzip.compress(data, compresslevel=1)
+            response.set_header('Content-Encoding', 'gzip')
+
+        response.content_type = MEDIA_JSON
+        response.data = data
 
 
 class ReplicationRestClient(IReplicationService[T]):
@@ -77,17 +150,15 @@ class ReplicationRestClient(IReplicationService[T]):
         """
         self._endpoint = endpoint
 
-        # Convert trust store to argument for verify option of requests
-        if trust_store:
-            self._verify = str(trust_store)     # type: Union[str, bool]
-        else:
-            self._verify = True
-
-        if not client_credentials:
-            self._cred = None   # type: Optional[Tuple[str, str]]
-        else:
-            self._cred = (
-                    str(client_credentials[0]), str(client_credentials[1]))
+        # Retry with exponential backoff if the server is down or
+        # overloaded, this takes about 15 seconds before giving up.
+        retry = _JitteredRetry(
+                total=5, backoff_factor=0.5,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET']),
+                respect_retry_after_header=True)
+        self._session = create_session(
+                trust_store, client_credentials, retry)
 
     def get_updates_since(
             self, from_version: Optional[int]) -> ReplicaUpdate[T]:
@@ -96,24 +167,44 @@ class ReplicationRestClient(IReplicationService[T]):
         Args:
             from_version: Version to start at, None to get all updates.
         """
+        return self._get_updates(from_version)[0]
+
+    def _get_updates(
+            self, from_version: Optional[int]
+            ) -> Tuple[ReplicaUpdate[T], Optional[str]]:
+        """Get updates since the given version, and their epoch.
+
+        Args:
+            from_version: Version to start at, None to get all updates.
+
+        Returns:
+            The update, and an id of the server instance that sent it,
+            if the server sent one.
+        """
         params = dict()     # type: Dict[str, int]
+        headers = dict()    # type: Dict[str, str]
         if from_version is not None:
             params['from_version'] = from_version
+            headers['If-None-Match'] = f'"{from_version}"'
+
+        r = self._retry_http_get(params, headers)
+        epoch = r.headers.get(EPOCH_HEADER)
 
-        r = self._retry_http_get(params)
+        if r.status_code == 304 and from_version is not None:
+            return self.UpdateType(
+                    from_version, from_version, _expiry_time(r), set(),
+                    set()), epoch
 
-        update_json = r.json()
+        update_json = orjson.loads(r.content)
         validate_json(self.UpdateType.__name__, update_json)
-        return deserialize(self.UpdateType, update_json)
+        return deserialize(self.UpdateType, update_json), epoch
 
-    @retry(                                             # type: ignore
-            stop_max_delay=20000, wait_fixed=500,
-            retry_on_exception=_retry_on_connection_error)
-    def _retry_http_get(self, params: Dict[str, int]) -> requests.Response:
+    def _retry_http_get(
+            self, params: Dict[str, int], headers: Dict[str, str]
+            ) -> requests.Response:
         """Do an HTTP get and retry for a while on failure."""
-        return requests.get(
-                self._endpoint, params=params, verify=self._verify,
-                cert=self._cred)
+        return self._session.get(
+                self._endpoint, params=params, headers=headers)
 
 
 class PolicyRestClient(ReplicationRestClient[Rule]):
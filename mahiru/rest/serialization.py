@@ -1,11 +1,15 @@
 """(De)Serialization of objects of various kinds to JSON."""
 import base64
+import sys
+import weakref
+from datetime import datetime
+from functools import lru_cache
 from typing import (
-        Any, Callable, cast, Dict, Optional, Type, TypeVar, Union)
+        Any, Callable, cast, Dict, Iterable, List, Optional, Tuple, Type,
+        TypeVar, Union)
 
 from cryptography.hazmat.primitives.serialization import Encoding
-from cryptography.x509 import load_pem_x509_certificate
-from dateutil import parser as dateparser
+from cryptography.x509 import Certificate, load_pem_x509_certificate
 
 from mahiru.definitions.assets import (
         Asset, ComputeAsset, ComputeMetadata, DataAsset, DataMetadata,
@@ -43,23 +47,95 @@ Serializable = Union[
 _SerializableT = TypeVar('_SerializableT', bound=Serializable)
 
 
+_b64e = base64.urlsafe_b64encode
+_b64d = base64.urlsafe_b64decode
+
+
+def _b64(signature: bytes) -> str:
+    """Encode a signature as a URL-safe base64 string."""
+    return _b64e(signature).decode('ascii')
+
+
+_StrT = TypeVar('_StrT', bound=str)
+
+
+def _intern(user_input: _StrT) -> _StrT:
+    """Intern a frequently recurring string from the input.
+
+    Replicas contain many copies of the same few party ids, namespaces
+    and endpoints, so we keep only one copy of each around. Strings of
+    other types (e.g. Identifiers) cannot be interned, and are returned
+    as they are.
+    """
+    if type(user_input) is str:
+        return cast(_StrT, sys.intern(user_input))
+    return user_input
+
+
 # Registered objects
 
 
+# The same certificates get (de)serialized over and over again as
+# registry replicas are updated, so we cache the conversion. Certificate
+# objects are immutable, and compare and hash by their DER encoding.
+@lru_cache(maxsize=256)
+def _certificate_to_pem(certificate: Certificate) -> str:
+    """Convert a certificate to a PEM string."""
+    return certificate.public_bytes(Encoding.PEM).decode('ascii')
+
+
+@lru_cache(maxsize=256)
+def _pem_to_certificate(pem: str) -> Certificate:
+    """Load a certificate from a PEM string."""
+    return load_pem_x509_certificate(pem.encode('ascii'))
+
+
+_RegisteredObjectT = TypeVar('_RegisteredObjectT', bound=RegisteredObject)
+
+
+# Registered objects don't change once they're signed, and the registry
+# sends the same ones out to every site, so we keep their JSON around.
+# Entries are keyed by object id and dropped when the object goes away.
+_registered_object_json = dict()    # type: Dict[int, Tuple[Any, bytes, JSON]]
+
+
+def _cache_json(
+        serializer: Callable[[_RegisteredObjectT], JSON]
+        ) -> Callable[[_RegisteredObjectT], JSON]:
+    """Cache the result of a RegisteredObject serializer.
+
+    The result is shared between calls, so it must not be modified.
+    If the object is signed again, it will be serialized anew.
+    """
+    def cached_serializer(obj: _RegisteredObjectT) -> JSON:
+        key = id(obj)
+        entry = _registered_object_json.get(key)
+        if entry is not None:
+            ref, signature, result = entry
+            if ref() is obj and signature == obj.signature:
+                return result
+
+        result = serializer(obj)
+        ref = weakref.ref(
+                obj, lambda _: _registered_object_json.pop(key, None))
+        _registered_object_json[key] = (ref, obj.signature, result)
+        return result
+
+    return cached_serializer
+
+
+@_cache_json
 def _serialize_party_description(party_desc: PartyDescription) -> JSON:
     """Serialize a PartyDescription object to JSON."""
-    main_certificate = party_desc.main_certificate.public_bytes(
-            Encoding.PEM).decode('ascii')
-    user_ca_certificate = party_desc.user_ca_certificate.public_bytes(
-            Encoding.PEM).decode('ascii')
+    main_certificate = _certificate_to_pem(party_desc.main_certificate)
+    user_ca_certificate = _certificate_to_pem(
+            party_desc.user_ca_certificate)
     user_certificates = [
-            c.public_bytes(Encoding.PEM).decode('ascii')
-            for c in party_desc.user_certificates]
+            _certificate_to_pem(c) for c in party_desc.user_certificates]
 
     return {
             'id': party_desc.id,
-            'signature': base64.urlsafe_b64encode(
-                party_desc.signature).decode(),
+            'signature': _b64(party_desc.signature),
             'namespace': party_desc.namespace,
             'main_certificate': main_certificate,
             'user_ca_certificate': user_ca_certificate,
@@ -69,54 +145,49 @@ def _serialize_party_description(party_desc: PartyDescription) -> JSON:
 def _deserialize_party_description(user_input: JSON) -> PartyDescription:
     """Deserialize a PartyDescription object from JSON."""
     id_ = user_input['id']
-    namespace = user_input['namespace']
-    main_certificate = load_pem_x509_certificate(
-            user_input['main_certificate'].encode('ascii'))
-    user_ca_certificate = load_pem_x509_certificate(
-            user_input['user_ca_certificate'].encode('ascii'))
+    namespace = _intern(user_input['namespace'])
+    main_certificate = _pem_to_certificate(user_input['main_certificate'])
+    user_ca_certificate = _pem_to_certificate(
+            user_input['user_ca_certificate'])
     user_certificates = [
-            load_pem_x509_certificate(c.encode('ascii'))
-            for c in user_input['user_certificates']]
+            _pem_to_certificate(c) for c in user_input['user_certificates']]
     result = PartyDescription(
             id_, namespace, main_certificate, user_ca_certificate,
             user_certificates)
-    result.signature = base64.urlsafe_b64decode(user_input['signature'])
+    result.signature = _b64d(user_input['signature'])
     return result
 
 
+@_cache_json
 def _serialize_site_description(site_desc: SiteDescription) -> JSON:
     """Serialize a SiteDescription object to JSON."""
-    https_certificate = site_desc.https_certificate.public_bytes(
-            Encoding.PEM).decode('ascii')
-
-    result = dict()     # type: JSON
-    result['id'] = site_desc.id
-    result['signature'] = base64.urlsafe_b64encode(
-            site_desc.signature).decode()
-    result['owner_id'] = site_desc.owner_id
-    result['admin_id'] = site_desc.admin_id
-    result['endpoint'] = site_desc.endpoint
-    result['https_certificate'] = https_certificate
-    result['has_store'] = site_desc.has_store
-    result['has_runner'] = site_desc.has_runner
-    result['has_policies'] = site_desc.has_policies
-    return result
+    https_certificate = _certificate_to_pem(site_desc.https_certificate)
+
+    return {
+            'id': site_desc.id,
+            'signature': _b64(site_desc.signature),
+            'owner_id': site_desc.owner_id,
+            'admin_id': site_desc.admin_id,
+            'endpoint': site_desc.endpoint,
+            'https_certificate': https_certificate,
+            'has_store': site_desc.has_store,
+            'has_runner': site_desc.has_runner,
+            'has_policies': site_desc.has_policies}
 
 
 def _deserialize_site_description(user_input: JSON) -> SiteDescription:
     """Deserialize a SiteDescription object from JSON."""
-    https_certificate = load_pem_x509_certificate(
-            user_input['https_certificate'].encode('ascii'))
+    https_certificate = _pem_to_certificate(user_input['https_certificate'])
     result = SiteDescription(
             user_input['id'],
-            user_input['owner_id'],
-            user_input['admin_id'],
-            user_input['endpoint'],
+            _intern(user_input['owner_id']),
+            _intern(user_input['admin_id']),
+            _intern(user_input['endpoint']),
             https_certificate,
             user_input['has_store'],
             user_input['has_runner'],
             user_input['has_policies'])
-    result.signature = base64.urlsafe_b64decode(user_input['signature'])
+    result.signature = _b64d(user_input['signature'])
     return result
 
 
@@ -134,7 +205,7 @@ def _serialize_in_asset_collection(rule: InAssetCollection) -> JSON:
     """Serialize an InAssetCollection object to JSON."""
     return {
             'type': 'InAssetCollection',
-            'signature': base64.urlsafe_b64encode(rule.signature).decode(),
+            'signature': _b64(rule.signature),
             'asset': rule.asset,
             'collection': rule.collection}
 
@@ -143,7 +214,7 @@ def _serialize_in_asset_category(rule: InAssetCategory) -> JSON:
     """Serialize an InAssetCategory object to JSON."""
     return {
             'type': 'InAssetCategory',
-            'signature': base64.urlsafe_b64encode(rule.signature).decode(),
+            'signature': _b64(rule.signature),
             'asset': rule.asset,
             'category': rule.category}
 
@@ -152,7 +223,7 @@ def _serialize_in_party_category(rule: InPartyCategory) -> JSON:
     """Serialize an InPartyCategory object to JSON."""
     return {
             'type': 'InPartyCategory',
-            'signature': base64.urlsafe_b64encode(rule.signature).decode(),
+            'signature': _b64(rule.signature),
             'party': rule.party,
             'category': rule.category}
 
@@ -161,7 +232,7 @@ def _serialize_may_access(rule: MayAccess) -> JSON:
     """Serialize a MayAccess object to JSON."""
     return {
             'type': 'MayAccess',
-            'signature': base64.urlsafe_b64encode(rule.signature).decode(),
+            'signature': _b64(rule.signature),
             'site': rule.site,
             'asset': rule.asset}
 
@@ -170,7 +241,7 @@ def _serialize_may_use(rule: MayUse) -> JSON:
     """Serialize a MayUse object to JSON."""
     return {
             'type': 'MayUse',
-            'signature': base64.urlsafe_b64encode(rule.signature).decode(),
+            'signature': _b64(rule.signature),
             'party': rule.party,
             'asset': rule.asset,
             'conditions': rule.conditions}
@@ -180,7 +251,7 @@ def _serialize_result_of_data_in(rule: ResultOfDataIn) -> JSON:
     """Serialize a ResultOfDataIn object to JSON."""
     return {
             'type': 'ResultOfDataIn',
-            'signature': base64.urlsafe_b64encode(rule.signature).decode(),
+            'signature': _b64(rule.signature),
             'data_asset': rule.data_asset,
             'compute_asset': rule.compute_asset,
             'output': rule.output,
@@ -191,40 +262,37 @@ def _serialize_result_of_compute_in(rule: ResultOfComputeIn) -> JSON:
     """Serialize a ResultOfComputeIn object to JSON."""
     return {
             'type': 'ResultOfComputeIn',
-            'signature': base64.urlsafe_b64encode(rule.signature).decode(),
+            'signature': _b64(rule.signature),
             'data_asset': rule.data_asset,
             'compute_asset': rule.compute_asset,
             'output': rule.output,
             'collection': rule.collection}
 
 
+_rule_constructors = {
+        'InAssetCollection': (InAssetCollection, ('asset', 'collection')),
+        'InAssetCategory': (InAssetCategory, ('asset', 'category')),
+        'InPartyCategory': (InPartyCategory, ('party', 'category')),
+        'MayAccess': (MayAccess, ('site', 'asset')),
+        'MayUse': (MayUse, ('party', 'asset', 'conditions')),
+        'ResultOfDataIn': (
+            ResultOfDataIn,
+            ('data_asset', 'compute_asset', 'output', 'collection')),
+        'ResultOfComputeIn': (
+            ResultOfComputeIn,
+            ('data_asset', 'compute_asset', 'output', 'collection')),
+        }   # type: Dict[str, Tuple[Callable[..., Rule], Tuple[str, ...]]]
+
+
 def _deserialize_rule(user_input: JSON) -> Rule:
     """Deserialize a Rule from JSON."""
-    rule = None     # type: Optional[Rule]
-    if user_input['type'] == 'InAssetCollection':
-        rule = InAssetCollection(user_input['asset'], user_input['collection'])
-    elif user_input['type'] == 'InAssetCategory':
-        rule = InAssetCategory(user_input['asset'], user_input['category'])
-    elif user_input['type'] == 'InPartyCategory':
-        rule = InPartyCategory(user_input['party'], user_input['category'])
-    elif user_input['type'] == 'MayAccess':
-        rule = MayAccess(user_input['site'], user_input['asset'])
-    elif user_input['type'] == 'MayUse':
-        rule = MayUse(
-                user_input['party'], user_input['asset'],
-                user_input['conditions'])
-    elif user_input['type'] == 'ResultOfDataIn':
-        rule = ResultOfDataIn(
-                user_input['data_asset'], user_input['compute_asset'],
-                user_input['output'], user_input['collection'])
-    elif user_input['type'] == 'ResultOfComputeIn':
-        rule = ResultOfComputeIn(
-                user_input['data_asset'], user_input['compute_asset'],
-                user_input['output'], user_input['collection'])
-    else:
+    try:
+        ctor, fields = _rule_constructors[user_input['type']]
+    except KeyError:
         raise RuntimeError('Invalid rule type when deserialising')
 
-    rule.signature = base64.urlsafe_b64decode(user_input['signature'])
+    rule = ctor(*[user_input[field] for field in fields])
+    rule.signature = _b64d(user_input['signature'])
     return rule
 
 
@@ -316,13 +384,18 @@ def _serialize_data_metadata(metadata: DataMetadata) -> JSON:
             'item': metadata.item}
 
 
+_metadata_serializers = {
+        ComputeMetadata: _serialize_compute_metadata,
+        DataMetadata: _serialize_data_metadata,
+        }   # type: Dict[Type[Metadata], Callable[[Any], JSON]]
+
+
 def _serialize_metadata(metadata: Metadata) -> JSON:
     """Serialize a Metadata to JSON."""
-    if isinstance(metadata, ComputeMetadata):
-        return _serialize_compute_metadata(metadata)
-    if isinstance(metadata, DataMetadata):
-        return _serialize_data_metadata(metadata)
-    raise RuntimeError('Invalid Metadata type')
+    try:
+        return _metadata_serializers[type(metadata)](metadata)
+    except KeyError:
+        raise RuntimeError('Invalid Metadata type')
 
 
 def _deserialize_compute_metadata(user_input: JSON) -> ComputeMetadata:
@@ -338,42 +411,67 @@ def _deserialize_data_metadata(user_input: JSON) -> DataMetadata:
 
 def _serialize_asset(asset: Asset) -> JSON:
     """Serialize an Asset to JSON."""
-    result = {
+    if asset.metadata is None:
+        return {
+                'id': asset.id,
+                'kind': asset.kind,
+                'data': asset.data,
+                'image_location': asset.image_location}
+
+    return {
             'id': asset.id,
             'kind': asset.kind,
             'data': asset.data,
-            'image_location': asset.image_location}
+            'image_location': asset.image_location,
+            'metadata': _serialize_metadata(asset.metadata)}
 
-    if asset.metadata is not None:
-        result['metadata'] = _serialize_metadata(asset.metadata)
 
-    return result
+_AssetConstructor = Tuple[Callable[..., Asset], Callable[[JSON], Metadata]]
+
+
+_asset_constructors = {
+        'compute': (ComputeAsset, _deserialize_compute_metadata),
+        'data': (DataAsset, _deserialize_data_metadata),
+        }   # type: Dict[str, _AssetConstructor]
 
 
 def _deserialize_asset(user_input: JSON) -> Asset:
     """Deserialize an Asset from JSON."""
-    if user_input['kind'] == 'compute':
-        return ComputeAsset(
-                user_input['id'], user_input['data'],
-                user_input['image_location'],
-                _deserialize_compute_metadata(user_input['metadata']))
-    elif user_input['kind'] == 'data':
-        return DataAsset(
-                user_input['id'], user_input['data'],
-                user_input['image_location'],
-                _deserialize_data_metadata(user_input['metadata']))
-    else:
+    try:
+        ctor, deserialize_metadata = _asset_constructors[user_input['kind']]
+    except KeyError:
         raise RuntimeError('Invalid asset type when deserialising')
 
+    return ctor(
+            user_input['id'], user_input['data'],
+            user_input['image_location'],
+            deserialize_metadata(user_input['metadata']))
+
 
 def _serialize_compute_asset(asset: ComputeAsset) -> JSON:
     """Serialize a ComputeAsset to JSON."""
-    return _serialize_asset(asset)
+    if asset.metadata is None:
+        return _serialize_asset(asset)
+
+    return {
+            'id': asset.id,
+            'kind': 'compute',
+            'data': asset.data,
+            'image_location': asset.image_location,
+            'metadata': _serialize_compute_metadata(asset.metadata)}
 
 
 def _serialize_data_asset(asset: DataAsset) -> JSON:
     """Serialize a DataAsset to JSON."""
-    return _serialize_asset(asset)
+    if asset.metadata is None:
+        return _serialize_asset(asset)
+
+    return {
+            'id': asset.id,
+            'kind': 'data',
+            'data': asset.data,
+            'image_location': asset.image_location,
+            'metadata': _serialize_data_metadata(asset.metadata)}
 
 
 # Connections
@@ -425,7 +523,7 @@ def _serialize_job_result(result: JobResult) -> JSON:
             'plan': _serialize_plan(result.plan),
             'is_done': result.is_done,
             'outputs': {
-                name: _serialize_asset(asset)
+                name: _serializers.get(type(asset), _serialize_asset)(asset)
                 for name, asset in result.outputs.items()}}
 
 
@@ -443,32 +541,81 @@ def _deserialize_job_result(user_input: JSON) -> JobResult:
 # Replica updates
 
 
+def _serialize_all(objs: Iterable[Serializable]) -> List[JSON]:
+    """Serialize a collection of objects to a list of JSON objects.
+
+    Replicas mostly contain objects of a single type, so this only
+    looks up the serializer again if the type changes.
+    """
+    result = list()     # type: List[JSON]
+    cur_type = None     # type: Optional[Type]
+    for obj in objs:
+        if type(obj) is not cur_type:
+            cur_type = type(obj)
+            serializer = _serializers[cur_type]
+        result.append(serializer(obj))
+    return result
+
+
 def _serialize_replica_update(update: IReplicaUpdate[_SerializableT]) -> JSON:
     """Serialize a ReplicaUpdate to JSON."""
-    result = dict()     # type: JSON
-    result['from_version'] = update.from_version
-    result['to_version'] = update.to_version
-    result['valid_until'] = update.valid_until.isoformat()
-    result['created'] = [serialize(o) for o in update.created]
-    result['deleted'] = [serialize(o) for o in update.deleted]
-    return result
+    return {
+            'from_version': update.from_version,
+            'to_version': update.to_version,
+            'valid_until': update.valid_until.isoformat(),
+            'created': _serialize_all(update.created),
+            'deleted': _serialize_all(update.deleted)}
 
 
 AnyReplicaUpdate = TypeVar('AnyReplicaUpdate', bound=ReplicaUpdate)
 
 
+def _parse_datetime(user_input: str) -> datetime:
+    """Parse an ISO 8601 date and time.
+
+    We produce these using datetime.isoformat(), but we also accept
+    a trailing Z for UTC, which fromisoformat() only supports from
+    Python 3.11.
+    """
+    if user_input.endswith('Z'):
+        user_input = user_input[:-1] + '+00:00'
+    if sys.version_info >= (3, 7):
+        return datetime.fromisoformat(user_input)
+    return _parse_datetime_strptime(user_input)
+
+
+def _parse_datetime_strptime(user_input: str) -> datetime:
+    """Parse a datetime.isoformat() string using strptime().
+
+    Python 3.6 doesn't have fromisoformat(), and its strptime() does
+    not accept a colon in the UTC offset, so we remove it first.
+    """
+    offset = ''
+    if (
+            len(user_input) > 19 and user_input[-6] in '+-' and
+            user_input[-3] == ':'):
+        offset = user_input[-6:-3] + user_input[-2:]
+        user_input = user_input[:-6]
+
+    fmt = '%Y-%m-%dT%H:%M:%S'
+    if '.' in user_input:
+        fmt += '.%f'
+    if offset:
+        fmt += '%z'
+    return datetime.strptime(user_input + offset, fmt)
+
+
 def _deserialize_replica_update(
         update_type: Type[AnyReplicaUpdate], user_input: JSON
         ) -> AnyReplicaUpdate:
     """Deserialize a ReplicaUpdate from JSON."""
+    deserializer = _deserialize[update_type.ReplicatedType]
     return update_type(
             user_input['from_version'],
             user_input['to_version'],
-            dateparser.isoparse(user_input['valid_until']),
-            {deserialize(update_type.ReplicatedType, o)
-                for o in user_input['created']},
-            {deserialize(update_type.ReplicatedType, o)
-                for o in user_input['deleted']})
+            _parse_datetime(user_input['valid_until']),
+            set(map(deserializer, user_input['created'])),
+            set(map(deserializer, user_input['deleted'])))
 
 
 def _deserialize_policy_update(user_input: JSON) -> PolicyUpdate:
@@ -0,0 +1,184 @@
+"""HTTP sessions for the REST clients.
+
+All our clients talk HTTPS using the same few trust stores and client
+certificates. Rather than having requests and urllib3 load the
+certificates from disk again for every new connection, we load them
+into an SSL context once per combination, and share that between all
+sessions that need it.
+"""
+from functools import lru_cache
+from pathlib import Path
+import ssl
+from threading import Lock
+from typing import Any, Dict, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import DEFAULT_CA_BUNDLE_PATH
+from urllib3.util.retry import Retry
+from urllib3.util.ssl_ import create_urllib3_context
+
+
+Timeout = Union[float, Tuple[float, float]]
+
+
+@lru_cache(maxsize=None)
+def _ssl_context(
+        trust_store: Optional[Path],
+        client_credentials: Optional[Tuple[Path, Path]]
+        ) -> ssl.SSLContext:
+    """Get an SSL context with the given certificates loaded.
+
+    Args:
+        trust_store: A file with trusted certificates/anchors, or
+                None to use the default CA bundle.
+        client_credentials: Paths to PEM files containing the HTTPS
+                client certificate and key to use, if any.
+
+    Returns:
+        An SSL context, shared between calls with the same arguments.
+    """
+    context = create_urllib3_context()
+    if trust_store:
+        context.load_verify_locations(cafile=str(trust_store))
+    else:
+        context.load_verify_locations(cafile=DEFAULT_CA_BUNDLE_PATH)
+
+    if client_credentials:
+        context.load_cert_chain(
+                str(client_credentials[0]), str(client_credentials[1]))
+    return context
+
+
+class _SSLContextAdapter(HTTPAdapter):
+    """An HTTPAdapter which uses a given SSL context.
+
+    The context has the trust store and client certificate loaded
+    already, so this adapter ignores the verify and cert arguments
+    that requests passes, which would make urllib3 load them again.
+    """
+    def __init__(
+            self, ssl_context: ssl.SSLContext, timeout: Optional[Timeout],
+            **kwargs: Any) -> None:
+        """Create an _SSLContextAdapter.
+
+        Args:
+            ssl_context: The SSL context to use for HTTPS connections.
+            timeout: Timeout to use for requests that don't specify
+                    one, see requests.
+            kwargs: Arguments for HTTPAdapter.
+        """
+        self._ssl_context = ssl_context
+        self._timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(
+            self, request: requests.PreparedRequest, stream: bool = False,
+            timeout: Any = None, verify: Any = True, cert: Any = None,
+            proxies: Any = None) -> requests.Response:
+        """Send a request, with our default timeout if none given."""
+        if timeout is None:
+            timeout = self._timeout
+        return super().send(request, stream, timeout, verify, cert, proxies)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        """Create the pool manager, using our SSL context."""
+        kwargs['ssl_context'] = self._ssl_context
+        super().init_poolmanager(*args, **kwargs)
+
+    def build_connection_pool_key_attributes(
+            self, request: requests.PreparedRequest, verify: Any,
+            cert: Any = None) -> Tuple[Any, Any]:
+        """Select connection pool settings, using our SSL context."""
+        attributes = super().build_connection_pool_key_attributes(
+                request, True, None)
+        attributes[1]['ssl_context'] = self._ssl_context
+        return attributes
+
+    def cert_verify(self, conn: Any, url: str, verify: Any, cert: Any) -> None:
+        """Do nothing, the SSL context is configured already."""
+        pass
+
+
+def create_session(
+        trust_store: Optional[Path] = None,
+        client_credentials: Optional[Tuple[Path, Path]] = None,
+        max_retries: Union[int, Retry] = 0,
+        pool_maxsize: int = 10,
+        timeout: Optional[Timeout] = None
+        ) -> requests.Session:
+    """Create a session for talking to a REST API.
+
+    Args:
+        trust_store: A file with trusted certificates/anchors.
+        client_credentials: Paths to PEM files containing the HTTPS
+                client certificate and key to use for
+                authentication.
+        max_retries: Retry policy to use, see HTTPAdapter.
+        pool_maxsize: Number of connections to keep open per host,
+                and number of hosts to keep connection pools for.
+        timeout: Default (connect, read) timeout in seconds for
+                requests, or None to wait forever.
+
+    Returns:
+        A new session object.
+    """
+    adapter = _SSLContextAdapter(
+            _ssl_context(trust_store, client_credentials), timeout,
+            max_retries=max_retries, pool_connections=pool_maxsize,
+            pool_maxsize=pool_maxsize)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_SessionKey = Tuple[
+        Optional[Path], Optional[Tuple[Path, Path]], Union[int, Retry], int,
+        Optional[Timeout]]
+
+
+_shared_sessions = dict()   # type: Dict[_SessionKey, requests.Session]
+
+
+_shared_sessions_lock = Lock()
+
+
+def shared_session(
+        trust_store: Optional[Path] = None,
+        client_credentials: Optional[Tuple[Path, Path]] = None,
+        max_retries: Union[int, Retry] = 0,
+        pool_maxsize: int = 10,
+        timeout: Optional[Timeout] = None
+        ) -> requests.Session:
+    """Get a session shared by all clients with the same settings.
+
+    This lets clients that talk to the same servers with the same
+    credentials use the same connection pools, so that connections
+    opened by one of them can be reused by the others.
+
+    Args:
+        trust_store: A file with trusted certificates/anchors.
+        client_credentials: Paths to PEM files containing the HTTPS
+                client certificate and key to use for
+                authentication.
+        max_retries: Retry policy to use, see HTTPAdapter. Retry
+                objects are compared by identity, so use a constant.
+        pool_maxsize: Number of connections to keep open per host,
+                and number of hosts to keep connection pools for.
+        timeout: Default (connect, read) timeout in seconds for
+                requests, or None to wait forever.
+
+    Returns:
+        A session object, which may be in use by other clients.
+    """
+    key = (
+            trust_store, client_credentials, max_retries, pool_maxsize,
+            timeout)
+    with _shared_sessions_lock:
+        if key not in _shared_sessions:
+            _shared_sessions[key] = create_session(
+                    trust_store, client_credentials, max_retries,
+                    pool_maxsize, timeout)
+        return _shared_sessions[key]
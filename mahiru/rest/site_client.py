@@ -1,18 +1,67 @@
 """Client for external REST APIs."""
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha256
+import re
 from pathlib import Path
-import requests
-from typing import Optional, Tuple, Union
+from shutil import copyfileobj
+from threading import Lock
+from types import TracebackType
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+from weakref import WeakValueDictionary
 from urllib.parse import quote
 
+import orjson
+from urllib3.util.retry import Retry
+
 from mahiru.definitions.assets import Asset
 from mahiru.definitions.connections import ConnectionInfo, ConnectionRequest
 from mahiru.definitions.identifier import Identifier
 from mahiru.definitions.workflows import ExecutionRequest
+from mahiru.rest.definitions import JSON, JSON_HEADERS
 from mahiru.rest.serialization import deserialize, serialize
+from mahiru.rest.session import shared_session
 from mahiru.rest.validation import validate_json
 from mahiru.components.registry_client import RegistryClient
 
 
+_VALIDATED_CACHE_SIZE = 256
+
+
+# Images at least this large are downloaded in this many parts at once
+_PARALLEL_DOWNLOAD_MIN_SIZE = 16 * 1024 * 1024
+
+_PARALLEL_DOWNLOADS = 4
+
+
+_PLAIN_ID_REGEX = re.compile(r'[A-Za-z0-9_.:-]*')
+
+
+def _quote_id(asset_id: str) -> str:
+    """Quote an asset id for use as a URL path segment.
+
+    This is quote(asset_id, safe=''), but with a fast path for the
+    characters that identifiers normally consist of, of which only the
+    colons need to be escaped.
+    """
+    if _PLAIN_ID_REGEX.fullmatch(asset_id):
+        return asset_id.replace(':', '%3A')
+    return quote(asset_id, safe='')
+
+
+# Retry idempotent requests if the other site is briefly unavailable.
+# POSTs are not retried, and failing responses are passed on.
+_RETRY = Retry(
+        total=3, connect=3, read=0, backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset(['GET', 'DELETE']),
+        raise_on_status=False)
+
+
+# (connect, read) timeouts in seconds, so that an unresponsive site
+# doesn't block us forever.
+_TIMEOUT = (3.05, 30.0)
+
+
 class SiteRestClient:
     """Handles connecting to other sites' runners and stores."""
     def __init__(
@@ -31,16 +80,54 @@ class SiteRestClient:
         """
         self._site = site
         self._registry_client = registry_client
-        if trust_store:
-            self._verify = str(trust_store)     # type: Union[str, bool]
-        else:
-            self._verify = True
+        self._session = shared_session(
+                trust_store, client_credentials, _RETRY, 32, _TIMEOUT)
 
-        if not client_credentials:
-            self._cred = None   # type: Optional[Tuple[str, str]]
-        else:
-            self._cred = (
-                    str(client_credentials[0]), str(client_credentials[1]))
+        # Digests of recently validated responses, in insertion order
+        self._validated = dict()   # type: Dict[Tuple[str, bytes], None]
+        self._validated_lock = Lock()
+
+        self._submit_pool = ThreadPoolExecutor(
+                4, thread_name_prefix=f'SiteRestClientSubmit-{site}')
+        self._retrieve_pool = ThreadPoolExecutor(
+                8, thread_name_prefix=f'SiteRestClientRetrieve-{site}')
+
+        # Number of users, see get_site_rest_client()
+        self._users = 1
+
+    def __enter__(self) -> 'SiteRestClient':
+        """Enter a with statement, returns this object."""
+        return self
+
+    def __exit__(
+            self, exc_type: Optional[Type[BaseException]],
+            exc_value: Optional[BaseException],
+            traceback: Optional[TracebackType]) -> None:
+        """Exit a with statement, closes the client."""
+        self.close()
+
+    def close(self) -> None:
+        """Finish sending requests and close any open connections.
+
+        The connection pool is shared with other clients using the same
+        credentials, and those will open new connections as needed.
+
+        If this client was obtained from get_site_rest_client(), then
+        it is only closed once each of its users has closed it.
+        """
+        with _clients_lock:
+            if self._users == 0:
+                return
+            self._users -= 1
+            if self._users > 0:
+                return
+            for key, client in list(_clients.items()):
+                if client is self:
+                    del _clients[key]
+
+        self._submit_pool.shutdown(wait=True)
+        self._retrieve_pool.shutdown(wait=True)
+        self._session.close()
 
     def retrieve_asset(self, site_id: Identifier, asset_id: Identifier
                        ) -> Asset:
@@ -51,50 +138,162 @@ class SiteRestClient:
             raise RuntimeError(f'Site or store at site {site_id} not found')
 
         if site.has_store:
-            safe_asset_id = quote(asset_id, safe='')
-            r = requests.get(
+            safe_asset_id = _quote_id(asset_id)
+            r = self._session.get(
                     f'{site.endpoint}/assets/{safe_asset_id}',
-                    params={'requester': self._site},
-                    verify=self._verify, cert=self._cred)
+                    params={'requester': self._site})
             if r.status_code == 404:
                 raise KeyError('Asset not found')
             elif not r.ok:
                 raise RuntimeError('Server error when retrieving asset')
 
-            asset_json = r.json()
-            validate_json('Asset', asset_json)
+            asset_json = orjson.loads(r.content)
+            self._validate_response('Asset', r.content, asset_json)
             return deserialize(Asset, asset_json)
 
         raise ValueError(f'Site {site_id} does not have a store')
 
+    def retrieve_assets(
+            self, assets: Iterable[Tuple[Identifier, Identifier]]
+            ) -> List[Optional[Asset]]:
+        """Obtains several assets from their stores concurrently.
+
+        Args:
+            assets: Pairs of the site to get each asset from and the
+                    id of the asset.
+
+        Returns:
+            The assets, in the same order, with None for any that were
+            not found.
+        """
+        def retrieve_if_available(
+                site_id: Identifier, asset_id: Identifier
+                ) -> Optional[Asset]:
+            """Obtains an asset, or None if it's not there."""
+            try:
+                return self.retrieve_asset(site_id, asset_id)
+            except KeyError:
+                return None
+
+        futures = [
+                self._retrieve_pool.submit(
+                    retrieve_if_available, site_id, asset_id)
+                for site_id, asset_id in assets]
+        return [future.result() for future in futures]
+
+    def _validate_response(
+            self, class_: str, content: bytes, response_json: JSON
+            ) -> None:
+        """Validate a response, unless we've recently seen it.
+
+        Sites poll for assets that are not yet available, and then
+        tend to download the same ones repeatedly, so we skip
+        validation of responses that are byte-for-byte identical to
+        one we've validated before.
+
+        Args:
+            class_: The name of the class from the schema to validate
+                against.
+            content: The raw body of the response.
+            response_json: The parsed body of the response.
+
+        Raises:
+            ValidationError: If the response was invalid.
+        """
+        key = (class_, sha256(content).digest())
+        with self._validated_lock:
+            if key in self._validated:
+                return
+
+        validate_json(class_, response_json)
+
+        with self._validated_lock:
+            self._validated[key] = None
+            if len(self._validated) > _VALIDATED_CACHE_SIZE:
+                del self._validated[next(iter(self._validated))]
+
     def retrieve_asset_image(self, asset_location: str, target: Path) -> None:
         """Obtains an asset image from a store.
 
         This downloads the image at the given location into a file at
-        the given path.
+        the given path. Large images are downloaded in several parts
+        concurrently, if the server supports that.
 
         Args:
             asset_location: URL of the image to download.
             target: Path of the file to save.
         """
-        with requests.get(
+        with self._session.get(
                 asset_location,
-                params={'requester': self._site},
-                stream=True, verify=self._verify, cert=self._cred) as r:
+                params={'requester': self._site}, stream=True) as r:
             if r.status_code == 404:
                 raise KeyError('Asset image not found')
             elif not r.ok:
                 raise RuntimeError('Server error when retrieving asset image')
 
-            if r.headers.get('Transfer-Encoding', '') == 'chunked':
-                chunk_size = None
+            size = int(r.headers.get('Content-Length', 0))
+            if (
+                    r.headers.get('Accept-Ranges') == 'bytes' and
+                    'Content-Encoding' not in r.headers and
+                    size >= _PARALLEL_DOWNLOAD_MIN_SIZE):
+                # Drop this response and get the image in parts instead
+                parallel = True
             else:
-                chunk_size = 1024 * 1024
+                parallel = False
+                r.raw.decode_content = True
+                with target.open('wb', buffering=0) as f:
+                    copyfileobj(r.raw, f, 256 * 1024)
+
+        if parallel:
+            self._retrieve_image_parallel(asset_location, target, size)
+
+    def _retrieve_image_parallel(
+            self, asset_location: str, target: Path, size: int) -> None:
+        """Download an image using several concurrent range requests.
+
+        Args:
+            asset_location: URL of the image to download.
+            target: Path of the file to save.
+            size: Size of the image in bytes.
+        """
+        part_size = -(-size // _PARALLEL_DOWNLOADS)
+        ranges = [
+                (start, min(start + part_size, size) - 1)
+                for start in range(0, size, part_size)]
+
+        with target.open('wb') as f:
+            f.truncate(size)
+
+        with ThreadPoolExecutor(len(ranges)) as pool:
+            # list() to raise any exceptions here
+            list(pool.map(
+                    lambda r: self._retrieve_image_range(
+                        asset_location, target, *r),
+                    ranges))
+
+    def _retrieve_image_range(
+            self, asset_location: str, target: Path, start: int, end: int
+            ) -> None:
+        """Download part of an image into the target file.
+
+        Args:
+            asset_location: URL of the image to download.
+            target: Path of the file to write to, must exist.
+            start: Offset of the first byte to download.
+            end: Offset of the last byte to download.
+        """
+        with self._session.get(
+                asset_location, params={'requester': self._site},
+                headers={'Range': f'bytes={start}-{end}'}, stream=True
+                ) as r:
+            if r.status_code != 206:
+                raise RuntimeError('Server error when retrieving asset image')
 
-            with target.open('wb') as f:
-                for chunk in r.iter_content(chunk_size):
-                    if chunk:
-                        f.write(chunk)
+            with target.open('r+b', buffering=0) as f:
+                f.seek(start)
+                copyfileobj(r.raw, f, 256 * 1024)
+                if f.tell() != end + 1:
+                    raise RuntimeError('Incomplete asset image received')
 
     def connect_to_asset(
             self, asset_id: Identifier, request: ConnectionRequest
@@ -120,15 +319,16 @@ class SiteRestClient:
             raise RuntimeError(f'Site or store at site {site_id} not found')
 
         if site.has_store:
-            safe_asset_id = quote(asset_id, safe='')
-            r = requests.post(
+            safe_asset_id = _quote_id(asset_id)
+            r = self._session.post(
                     f'{site.endpoint}/assets/{safe_asset_id}/connect',
-                    params={'requester': self._site}, json=serialize(request),
-                    verify=self._verify, cert=self._cred)
+                    params={'requester': self._site},
+                    data=orjson.dumps(serialize(request)),
+                    headers=JSON_HEADERS)
             if not r.ok:
                 raise RuntimeError('Could not connect to asset')
 
-            conn_info_json = r.json()
+            conn_info_json = orjson.loads(r.content)
             validate_json('ConnectionInfo', conn_info_json)
             return deserialize(ConnectionInfo, conn_info_json)
 
@@ -151,21 +351,29 @@ class SiteRestClient:
         except KeyError:
             raise RuntimeError(f'Site or store at site {site_id} not found')
 
-        r = requests.delete(
+        r = self._session.delete(
                 f'{site.endpoint}/connections/{conn_id}',
-                params={'requester': self._site}, verify=self._verify,
-                cert=self._cred)
+                params={'requester': self._site})
         if not r.ok:
             raise RuntimeError('Could not disconnect asset')
 
     def submit_request(
-            self, site_id: Identifier, request: ExecutionRequest) -> None:
+            self, site_id: Identifier, request: ExecutionRequest
+            ) -> 'Future[None]':
         """Submits a request for execution to a local runner.
 
+        The request is sent in the background, so this returns as soon
+        as the site has been looked up.
+
         Args:
             site_id: The site to submit to.
             request: The execution request to send.
 
+        Returns:
+            A future which completes when the site has accepted the
+            request, and raises if it could not be delivered or the
+            site refused it.
+
         """
         try:
             site = self._registry_client.get_site_by_id(site_id)
@@ -173,8 +381,61 @@ class SiteRestClient:
             raise RuntimeError(f'Site or runner at site {site_id} not found')
 
         if site.has_runner:
-            requests.post(
-                    f'{site.endpoint}/jobs', json=serialize(request),
-                    verify=self._verify, cert=self._cred)
+            return self._submit_pool.submit(
+                    self._post_request, site_id, f'{site.endpoint}/jobs',
+                    orjson.dumps(serialize(request)))
         else:
             raise ValueError(f'Site {site_id} does not have a runner')
+
+    def _post_request(
+            self, site_id: Identifier, url: str, data: bytes) -> None:
+        """Send a request to a runner, raising if it is refused."""
+        r = self._session.post(url, data=data, headers=JSON_HEADERS)
+        if not r.ok:
+            raise RuntimeError(
+                    f'Site {site_id} refused execution request:'
+                    f' {r.status_code} {r.reason}')
+
+
+_ClientKey = Tuple[str, int, Optional[Path], Optional[Tuple[Path, Path]]]
+
+
+_clients = WeakValueDictionary(
+        )   # type: WeakValueDictionary[_ClientKey, SiteRestClient]
+
+
+_clients_lock = Lock()
+
+
+def get_site_rest_client(
+        site: str, registry_client: RegistryClient,
+        trust_store: Optional[Path] = None,
+        client_credentials: Optional[Tuple[Path, Path]] = None
+        ) -> SiteRestClient:
+    """Get a SiteRestClient shared within this process.
+
+    Components acting for the same site share a client, and with it its
+    validation cache and thread pools, as long as any of them still
+    holds on to it. Each caller should close the client when done with
+    it, it is actually closed when the last of them does.
+
+    Args:
+        site: The site at which the client acts.
+        registry_client: A registry client to get sites from.
+        trust_store: A file with trusted certificates/anchors.
+        client_credentials: An HTTPS client certificate and the
+                corresponding key, as paths to PEM files.
+
+    Returns:
+        A new or existing SiteRestClient with these settings.
+    """
+    key = (site, id(registry_client), trust_store, client_credentials)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = SiteRestClient(
+                    site, registry_client, trust_store, client_credentials)
+            _clients[key] = client
+        else:
+            client._users += 1
+        return client
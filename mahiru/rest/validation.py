@@ -3,14 +3,19 @@
 This module is decidedly less object oriented than the rest of the
 code, but that seems to be the best way to do this here. The
 validate_json() function is a pure function, and what state there
-is for technical reasons is constant. If you consider the declarations
-in the YAML file to be code (type definitions), then what we're doing
-here is no different from importing something from another module.
+is for technical reasons is constant once it has been created on
+first use. If you consider the declarations in the YAML file to be
+code (type definitions), then what we're doing here is no different
+from importing something from another module.
 
 """
+from hashlib import sha256
+import os
 from pathlib import Path
-from typing import Dict
-import ruamel.yaml as yaml
+from threading import Lock
+from typing import Any, cast, Dict, Optional
+
+import orjson
 
 import jsonschema
 from jsonschema.validators import RefResolver
@@ -20,10 +25,75 @@ from mahiru.definitions.errors import ValidationError
 from mahiru.rest.definitions import JSON
 
 
-def _create_validators() -> Dict[str, OAS30Validator]:
+def _cache_file(digest: str) -> Optional[Path]:
+    """Return the cache file for a schema file with the given hash.
+
+    This is in the user's cache directory, or None if there isn't one.
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    try:
+        cache_dir = Path(cache_home) if cache_home else Path.home() / '.cache'
+    except (RuntimeError, KeyError):
+        return None
+    return cache_dir / 'mahiru' / f'schemas-{digest}.json'
+
+
+def _load_cached_schemas(
+        cache_file: Path, digest: str) -> Optional[Dict[str, Any]]:
+    """Load schemas from the cache, if it matches the source."""
+    try:
+        cache = orjson.loads(cache_file.read_bytes())
+        if cache['source_sha256'] == digest:
+            return cast(Dict[str, Any], cache['schemas'])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+
+def _save_cached_schemas(
+        cache_file: Path, digest: str, schemas: Dict[str, Any]) -> None:
+    """Save schemas to the cache, if we can write to it."""
+    tmp_file = cache_file.with_name(f'{cache_file.name}.{os.getpid()}.tmp')
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file.write_bytes(orjson.dumps({
+            'source_sha256': digest, 'schemas': schemas}))
+        os.replace(tmp_file, cache_file)
+    except (OSError, TypeError, ValueError):
+        # e.g. no writable cache dir, we'll parse the YAML next time
+        try:
+            tmp_file.unlink()
+        except OSError:
+            pass
+
+
+def _load_schemas() -> Dict[str, Any]:
+    """Load the schemas, using a JSON cache if available.
+
+    Parsing the YAML is slow enough to noticeably delay start-up, so we
+    cache the result as JSON in the user's cache directory, and use
+    that as long as the YAML file has the same contents.
+    """
     schemas_file = Path(__file__).parent / 'schemas.yaml'
-    with open(schemas_file, 'r') as f:
-        schemas = yaml.safe_load(f.read())
+    source = schemas_file.read_bytes()
+    digest = sha256(source).hexdigest()
+    cache_file = _cache_file(digest)
+
+    schemas = None
+    if cache_file is not None:
+        schemas = _load_cached_schemas(cache_file, digest)
+
+    if schemas is None:
+        import ruamel.yaml as yaml
+
+        schemas = yaml.safe_load(source.decode('utf-8'))
+        if cache_file is not None:
+            _save_cached_schemas(cache_file, digest, schemas)
+    return schemas
+
+
+def _create_validators() -> Dict[str, OAS30Validator]:
+    schemas = _load_schemas()
 
     ref_resolver = RefResolver.from_schema(schemas)
     validators = dict()     # type: Dict[str, OAS30Validator]
@@ -34,7 +104,20 @@ def _create_validators() -> Dict[str, OAS30Validator]:
     return validators
 
 
-_validators = _create_validators()
+_validators = None      # type: Optional[Dict[str, OAS30Validator]]
+
+
+_validators_lock = Lock()
+
+
+def _get_validators() -> Dict[str, OAS30Validator]:
+    """Return the validators, creating them on first use."""
+    global _validators
+    if _validators is None:
+        with _validators_lock:
+            if _validators is None:
+                _validators = _create_validators()
+    return _validators
 
 
 def validate_json(class_: str, user_input: JSON) -> None:
@@ -50,6 +133,6 @@ def validate_json(class_: str, user_input: JSON) -> None:
         ValidationError: If the input was invalid.
     """
     try:
-        _validators[class_].validate(user_input)
+        _get_validators()[class_].validate(user_input)
     except jsonschema.ValidationError as e:
         raise ValidationError(*e.args)
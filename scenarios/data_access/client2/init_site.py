@@ -106,7 +106,7 @@ def add_initial_rules(
 
     for rule in rules:
         rule.sign(main_key)
-        client.add_rule(rule)
+    client.add_rules(rules)
 
 
 if __name__ == "__main__":
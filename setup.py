@@ -43,9 +43,8 @@ setup(
         'docker',
         'falcon==3.0.0a3',
         'openapi-schema-validator',
-        'python-dateutil',
+        'orjson',
         'requests',
-        'retrying',
         'ruamel.yaml<=0.16.10',
         'yatiml'
     ]
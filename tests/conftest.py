@@ -5,7 +5,6 @@ This is a PyTest special file, see its documentation.
 import logging
 from pathlib import Path
 from unittest.mock import patch
-from wsgiref.simple_server import WSGIServer
 
 from cryptography import x509
 from cryptography.hazmat.primitives.serialization import load_pem_private_key
@@ -13,6 +12,7 @@ import pytest
 
 from mahiru.components.registry_client import RegistryClient
 from mahiru.registry.registry import Registry
+from mahiru.rest.definitions import ThreadingWSGIServer
 from mahiru.rest.registry import RegistryRestApi, RegistryServer
 from mahiru.rest.registry_client import (
         RegistrationRestClient, RegistryRestClient)
@@ -23,8 +23,8 @@ logging.basicConfig(level=logging.INFO, format=log_format)
 logging.getLogger('filelock').setLevel(logging.WARNING)
 
 
-class ReusingWSGIServer(WSGIServer):
-    """A simple WSGI server which allows reusing the port.
+class ReusingWSGIServer(ThreadingWSGIServer):
+    """A threading WSGI server which allows reusing the port.
 
     This disables the usual timeout the kernel imposes before you can
     reuse a server port (TIME_WAIT). We accept the reduced security
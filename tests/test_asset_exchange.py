@@ -1,10 +1,12 @@
 from datetime import datetime
 import logging
-from unittest.mock import MagicMock
+import os
+from unittest.mock import MagicMock, patch
 from threading import Thread
+from urllib.parse import quote
 from wsgiref.simple_server import WSGIRequestHandler
 
-from falcon import App
+from falcon import App, testing
 import pytest
 import requests
 
@@ -13,8 +15,10 @@ from mahiru.definitions.assets import DataAsset
 from mahiru.definitions.identifier import Identifier
 from mahiru.definitions.registry import RegisteredObject
 from mahiru.replication import ReplicaUpdate
-from mahiru.rest.site_client import SiteRestClient
-from mahiru.rest.ddm_site import AssetImageAccessHandler, ThreadingWSGIServer
+from mahiru.rest.site_client import (
+        _quote_id, get_site_rest_client, SiteRestClient)
+from mahiru.rest.ddm_site import (
+        _FileRange, AssetImageAccessHandler, ThreadingWSGIServer)
 
 
 @pytest.fixture
@@ -30,12 +34,37 @@ def asset_store(temp_path, test_image_file, asset_id):
     return asset_store
 
 
-@pytest.fixture
-def image_server(asset_store):
+def _image_app(asset_store):
     app = App()
     asset_image_access = AssetImageAccessHandler(
             MagicMock(), asset_store)
     app.add_route('/assets/{asset_id}/image', asset_image_access)
+    return app
+
+
+@pytest.fixture
+def large_image():
+    # not a multiple of the number of parallel downloads
+    return os.urandom(1024 * 1024 + 3)
+
+
+@pytest.fixture
+def large_asset_store(temp_path, image_dir, large_image, asset_id):
+    image_file = temp_path / 'large_image.tar.gz'
+    image_file.write_bytes(large_image)
+    asset_store = AssetStore(MagicMock(), MagicMock(), image_dir)
+    asset_store.store(DataAsset(asset_id, None, str(image_file)))
+    return asset_store
+
+
+@pytest.fixture
+def image_client(large_asset_store):
+    return testing.TestClient(_image_app(large_asset_store))
+
+
+@pytest.fixture
+def image_server(asset_store):
+    app = _image_app(asset_store)
     server = ThreadingWSGIServer(('0.0.0.0', 0), WSGIRequestHandler)
     server.set_app(app)
 
@@ -78,3 +107,194 @@ def test_asset_download(
         image_data = f.read()
 
     assert image_data == 'testing'
+
+
+def test_validation_cache(monkeypatch, mock_empty_registry_client):
+    validated = list()
+    monkeypatch.setattr(
+            'mahiru.rest.site_client.validate_json',
+            lambda class_, json: validated.append(json))
+
+    client = SiteRestClient('site:ns:site', mock_empty_registry_client)
+    client._validate_response('Asset', b'{"id": 1}', {'id': 1})
+    client._validate_response('Asset', b'{"id": 1}', {'id': 1})
+    assert validated == [{'id': 1}]
+
+    client._validate_response('Asset', b'{"id": 2}', {'id': 2})
+    client._validate_response('ConnectionInfo', b'{"id": 1}', {'id': 1})
+    assert validated == [{'id': 1}, {'id': 2}, {'id': 1}]
+
+
+def test_submit_request_refused(
+        monkeypatch, image_server, mock_empty_registry_client):
+    monkeypatch.setattr(
+            'mahiru.rest.site_client.serialize', lambda request: {})
+    site = MagicMock()
+    site.endpoint = image_server
+    mock_empty_registry_client.get_site_by_id.return_value = site
+
+    with SiteRestClient('site:ns:site', mock_empty_registry_client) as client:
+        submission = client.submit_request(
+                Identifier('site:ns:other_site'), MagicMock())
+        with pytest.raises(RuntimeError):
+            submission.result()
+
+
+def test_shared_client_close(mock_empty_registry_client):
+    client1 = get_site_rest_client('site:ns:site', mock_empty_registry_client)
+    client2 = get_site_rest_client('site:ns:site', mock_empty_registry_client)
+    assert client1 is client2
+
+    client1.close()
+    assert client2._submit_pool.submit(lambda: 42).result() == 42
+
+    client2.close()
+    with pytest.raises(RuntimeError):
+        client2._submit_pool.submit(lambda: 42)
+
+    client3 = get_site_rest_client('site:ns:site', mock_empty_registry_client)
+    assert client3 is not client1
+    client3.close()
+
+
+def test_quote_id():
+    for asset_id in (
+            'asset:ns:test_asset:ns:site', 'asset:ns:a.b-c_d:ns:s',
+            'asset:ns:we/ird?:ns:site', ''):
+        assert _quote_id(asset_id) == quote(asset_id, safe='')
+
+
+def test_asset_download_range(asset_id, image_server):
+    url = f'{image_server}/assets/{asset_id}/image'
+    params = {'requester': 'site:ns:site'}
+
+    r = requests.get(url, params=params, headers={'Range': 'bytes=1-3'})
+    assert r.status_code == 206
+    assert r.headers['Content-Range'] == 'bytes 1-3/7'
+    assert r.content == b'est'
+
+    r = requests.get(url, params=params, headers={'Range': 'bytes=-2'})
+    assert r.status_code == 206
+    assert r.content == b'ng'
+
+    r = requests.get(url, params=params, headers={'Range': 'bytes=7-'})
+    assert r.status_code == 416
+
+
+def test_asset_download_parallel(
+        monkeypatch, temp_path, asset_id, image_server,
+        mock_empty_registry_client):
+    monkeypatch.setattr(
+            'mahiru.rest.site_client._PARALLEL_DOWNLOAD_MIN_SIZE', 1)
+
+    client = SiteRestClient('site:ns:site', mock_empty_registry_client)
+
+    download_path = temp_path / 'retrieved_image.tar.gz'
+    client.retrieve_asset_image(
+            f'{image_server}/assets/{asset_id}/image', download_path)
+
+    with download_path.open('r') as f:
+        image_data = f.read()
+
+    assert image_data == 'testing'
+
+
+def test_file_range(test_image_file):
+    file_range = _FileRange(test_image_file.open('rb'), 1, 5)
+    assert file_range.read(2) == b'es'
+    assert file_range.read() == b'tin'
+    assert file_range.read(1) == b''
+    file_range.close()
+
+
+def test_image_get_full(image_client, asset_id, large_image):
+    result = image_client.simulate_get(
+            f'/assets/{asset_id}/image',
+            params={'requester': 'site:ns:site'})
+    assert result.status_code == 200
+    assert result.headers['Accept-Ranges'] == 'bytes'
+    assert result.content == large_image
+
+
+def test_image_get_range(image_client, asset_id, large_image):
+    size = len(large_image)
+    url = f'/assets/{asset_id}/image'
+    params = {'requester': 'site:ns:site'}
+
+    result = image_client.simulate_get(
+            url, params=params, headers={'Range': 'bytes=10-19'})
+    assert result.status_code == 206
+    assert result.headers['Content-Range'] == f'bytes 10-19/{size}'
+    assert result.content == large_image[10:20]
+
+    result = image_client.simulate_get(
+            url, params=params, headers={'Range': f'bytes={size - 5}-'})
+    assert result.status_code == 206
+    assert result.content == large_image[-5:]
+
+    result = image_client.simulate_get(
+            url, params=params, headers={'Range': 'bytes=-100'})
+    assert result.status_code == 206
+    assert result.content == large_image[-100:]
+
+
+def test_image_get_range_chunks(image_client, asset_id, large_image):
+    size = len(large_image)
+    chunk_size = 300 * 1024
+    chunks = list()
+    for start in range(0, size, chunk_size):
+        end = min(start + chunk_size, size) - 1
+        result = image_client.simulate_get(
+                f'/assets/{asset_id}/image',
+                params={'requester': 'site:ns:site'},
+                headers={'Range': f'bytes={start}-{end}'})
+        assert result.status_code == 206
+        assert result.headers['Content-Range'] == (
+                f'bytes {start}-{end}/{size}')
+        assert len(result.content) == end - start + 1
+        chunks.append(result.content)
+
+    assert len(chunks) == 4
+    assert b''.join(chunks) == large_image
+
+
+def test_image_get_range_invalid(image_client, asset_id, large_image):
+    size = len(large_image)
+    result = image_client.simulate_get(
+            f'/assets/{asset_id}/image',
+            params={'requester': 'site:ns:site'},
+            headers={'Range': f'bytes={size}-{size + 10}'})
+    assert result.status_code == 416
+    assert result.headers['Content-Range'] == f'bytes */{size}'
+    assert not result.content
+
+
+def test_asset_download_parallel_large(
+        monkeypatch, temp_path, asset_id, large_asset_store, large_image,
+        mock_empty_registry_client):
+    monkeypatch.setattr(
+            'mahiru.rest.site_client._PARALLEL_DOWNLOAD_MIN_SIZE', 1024)
+
+    server = ThreadingWSGIServer(('0.0.0.0', 0), WSGIRequestHandler)
+    server.set_app(_image_app(large_asset_store))
+    thread = Thread(target=server.serve_forever, name='TestServer')
+    thread.start()
+
+    try:
+        client = SiteRestClient('site:ns:site', mock_empty_registry_client)
+        url = (
+                f'http://{server.server_name}:{server.server_port}'
+                f'/assets/{asset_id}/image')
+        download_path = temp_path / 'retrieved_image.tar.gz'
+        with patch.object(
+                client, '_retrieve_image_range',
+                wraps=client._retrieve_image_range) as retrieve_range:
+            client.retrieve_asset_image(url, download_path)
+            assert retrieve_range.call_count == 4
+
+        assert download_path.read_bytes() == large_image
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
@@ -0,0 +1,65 @@
+from threading import Thread
+from unittest.mock import MagicMock, patch
+
+from mahiru.rest.internal_client import (
+        _job_uri_regex, InternalSiteRestClient)
+
+
+def test_coalesce_job_result_waiters():
+    client = InternalSiteRestClient(
+            'party:ns:party', 'site:ns:site', 'http://localhost:1')
+
+    polls = list()
+
+    def get_job_result(job_id):
+        polls.append(job_id)
+        result = MagicMock()
+        result.is_done = len(polls) >= 4
+        return result
+
+    results = list()
+
+    def wait():
+        results.append(client.get_job_result('job1'))
+
+    with patch.object(client, '_get_job_result', get_job_result), \
+            patch('mahiru.rest.internal_client._JOB_RESULT_WAIT_TIME', 0.05):
+        threads = [Thread(target=wait) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert len(results) == 4
+    assert all(result is results[0] for result in results)
+    assert len(polls) == 4
+    assert not client._pending_results
+
+
+def test_job_uri_regex():
+    regex = _job_uri_regex('https://site1.example.org/internal/jobs')
+    assert regex.match('https://site1.example.org/internal/jobs/1')
+    assert regex.match('https://site1.example.org:443/internal/jobs/12')
+    assert not regex.match('https://site1.example.org:444/internal/jobs/1')
+    assert not regex.match('http://site1.example.org/internal/jobs/1')
+    assert not regex.match('https://site1.example.org.evil/internal/jobs/1')
+    assert not regex.match('https://site1.example.org/internal/jobs/')
+    assert not regex.match('https://site1.example.org/internal/jobs/1/..')
+
+    regex = _job_uri_regex('http://localhost:5000/internal/jobs')
+    assert regex.match('http://localhost:5000/internal/jobs/3')
+    assert not regex.match('http://localhost/internal/jobs/3')
+
+    regex = _job_uri_regex('http://[::1]:5000/internal/jobs')
+    assert regex.match('http://[::1]:5000/internal/jobs/3')
+    assert not regex.match('http://[::2]:5000/internal/jobs/3')
+    assert not regex.match('http://::1:5000/internal/jobs/3')
+
+    regex = _job_uri_regex('https://[2001:db8::1]/internal/jobs')
+    assert regex.match('https://[2001:db8::1]/internal/jobs/3')
+    assert regex.match('https://[2001:db8::1]:443/internal/jobs/3')
+
+    regex = _job_uri_regex('HTTP://Site1.Example.org:5000/internal/jobs')
+    assert regex.match('http://site1.example.org:5000/internal/jobs/3')
+    assert regex.match('HTTP://Site1.Example.org:5000/internal/jobs/3')
+    assert not regex.match('http://site1.example.org:5000/Internal/jobs/3')
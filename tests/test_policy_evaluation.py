@@ -167,6 +167,22 @@ def test_asset_category_access(asset1, asset_category1a, site1):
     assert not evaluator.may_access(perms, site1)
 
 
+def test_policy_update(asset1, asset_collection1a, site1):
+    rules = [MayAccess(site1, asset_collection1a)]
+    policies = MockPolicies(rules)
+    evaluator = PolicyEvaluator(policies)
+
+    perms = evaluator.permissions_for_asset(asset1)
+    assert not evaluator.may_access(perms, site1)
+
+    rules.append(InAssetCollection(asset1, asset_collection1a))
+    perms = evaluator.permissions_for_asset(asset1)
+    assert evaluator.may_access(perms, site1)
+
+    rules.clear()
+    assert not evaluator.may_access(perms, site1)
+
+
 def test_site_category_access(asset1, site_category1a, site2):
     policies = MockPolicies([
         InSiteCategory(site2, site_category1a),
@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta, timezone
+import gzip
+from unittest.mock import patch
+
+from falcon import testing
+import orjson
+import pytest
+
+from mahiru.definitions.identifier import Identifier
+from mahiru.definitions.registry import PartyDescription
+from mahiru.registry.registry import Registry
+from mahiru.registry.replication import RegistryUpdate
+from mahiru.rest.registry import RegistryRestApi
+from mahiru.rest.registry_client import RegistryRestClient
+from mahiru.rest.serialization import (
+        _parse_datetime, _parse_datetime_strptime, deserialize)
+from mahiru.rest.validation import validate_json
+
+
+@pytest.fixture
+def party1(
+        party1_main_key, party1_main_certificate, party1_user_ca_certificate):
+    party1 = PartyDescription(
+            Identifier('party:party1_ns:party1'), 'ns',
+            party1_main_certificate, party1_user_ca_certificate, [])
+    party1.sign(party1_main_key)
+    return party1
+
+
+@pytest.fixture
+def party2(
+        party2_main_key, party2_main_certificate, party2_user_ca_certificate):
+    party2 = PartyDescription(
+            Identifier('party:party2_ns:party2'), 'ns',
+            party2_main_certificate, party2_user_ca_certificate, [])
+    party2.sign(party2_main_key)
+    return party2
+
+
+@pytest.fixture
+def registry(party1):
+    registry = Registry()
+    registry.register_party(party1)
+    return registry
+
+
+@pytest.fixture
+def client(registry):
+    return testing.TestClient(RegistryRestApi(registry).app)
+
+
+def test_updates_gzip(client, party1):
+    result = client.simulate_get(
+            '/updates', params={'from_version': 0},
+            headers={'Accept-Encoding': 'gzip, deflate'})
+
+    assert result.status_code == 200
+    assert result.headers['Content-Encoding'] == 'gzip'
+    update_json = orjson.loads(gzip.decompress(result.content))
+    validate_json('RegistryUpdate', update_json)
+    update = deserialize(RegistryUpdate, update_json)
+    assert update.created == {party1}
+
+
+def test_updates_identity(client, party1):
+    result = client.simulate_get('/updates', params={'from_version': 0})
+
+    assert result.status_code == 200
+    assert 'Content-Encoding' not in result.headers
+    update = deserialize(RegistryUpdate, result.json)
+    assert update.created == {party1}
+
+    result = client.simulate_get(
+            '/updates', params={'from_version': 0},
+            headers={'Accept-Encoding': 'gzip;q=0'})
+    assert 'Content-Encoding' not in result.headers
+
+
+def test_updates_not_modified(client, registry, party1):
+    result = client.simulate_get('/updates', params={'from_version': 0})
+    version = result.json['to_version']
+    assert result.headers['ETag'] == f'"{version}"'
+
+    result = client.simulate_get(
+            '/updates', params={'from_version': version},
+            headers={'If-None-Match': f'"{version}"'})
+    assert result.status_code == 304
+    assert not result.content
+    assert 'Expires' in result.headers
+
+    registry.deregister_party(party1.id)
+    result = client.simulate_get(
+            '/updates', params={'from_version': version},
+            headers={'If-None-Match': f'"{version}"'})
+    assert result.status_code == 200
+    assert result.headers['ETag'] == f'"{version + 1}"'
+
+
+def test_parse_datetime():
+    for value in (
+            datetime(2021, 3, 4, 5, 6, 7),
+            datetime(2021, 3, 4, 5, 6, 7, 890123),
+            datetime(2021, 3, 4, 5, 6, 7, tzinfo=timezone.utc),
+            datetime(
+                2021, 3, 4, 5, 6, 7, 890123,
+                timezone(timedelta(hours=-2, minutes=-30)))):
+        assert _parse_datetime(value.isoformat()) == value
+        assert _parse_datetime_strptime(value.isoformat()) == value
+
+    utc = datetime(2021, 3, 4, 5, 6, 7, tzinfo=timezone.utc)
+    assert _parse_datetime('2021-03-04T05:06:07Z') == utc
+
+
+def test_client_not_modified(
+        registry_server, registration_client, party1):
+    rest_client = RegistryRestClient()
+    registration_client.register_party(party1)
+
+    update1 = rest_client.get_updates_since(0)
+    assert update1.created == {party1}
+
+    statuses = list()
+    http_get = rest_client._retry_http_get
+
+    def recording_http_get(params, headers):
+        response = http_get(params, headers)
+        statuses.append(response.status_code)
+        return response
+
+    with patch.object(
+            rest_client, '_retry_http_get', side_effect=recording_http_get):
+        update2 = rest_client.get_updates_since(update1.to_version)
+    assert statuses == [304]
+    assert update2.from_version == update1.to_version
+    assert update2.to_version == update1.to_version
+    assert not update2.created
+    assert not update2.deleted
+
+
+def test_client_cache(
+        registry_server, registration_client, party1, temp_path):
+    registration_client.register_party(party1)
+
+    rest_client1 = RegistryRestClient(cache_dir=temp_path)
+    update1 = rest_client1.get_updates_since(0)
+    assert update1.created == {party1}
+    assert (temp_path / 'registry_cache.json').exists()
+
+    rest_client2 = RegistryRestClient(cache_dir=temp_path)
+    with patch.object(
+            rest_client2, '_retry_http_get',
+            wraps=rest_client2._retry_http_get) as http_get:
+        update2 = rest_client2.get_updates_since(0)
+        params = http_get.call_args[0][0]
+        assert params['from_version'] == update1.to_version
+
+    assert update2.from_version == 0
+    assert update2.to_version == update1.to_version
+    assert update2.created == {party1}
+
+
+def test_client_cache_registry_restart(party1, party2, temp_path):
+    def serve(rest_client, api):
+        test_client = testing.TestClient(api.app)
+
+        def http_get(params, headers):
+            return test_client.simulate_get(
+                    '/updates', params=params, headers=headers)
+
+        return patch.object(
+                rest_client, '_retry_http_get', side_effect=http_get)
+
+    registry1 = Registry()
+    registry1.register_party(party1)
+    api1 = RegistryRestApi(registry1)
+    rest_client1 = RegistryRestClient(cache_dir=temp_path)
+    with serve(rest_client1, api1):
+        update1 = rest_client1.get_updates_since(0)
+    assert update1.created == {party1}
+
+    # restarted registry, same version but different contents
+    registry2 = Registry()
+    registry2.register_party(party2)
+    api2 = RegistryRestApi(registry2)
+    rest_client2 = RegistryRestClient(cache_dir=temp_path)
+    with serve(rest_client2, api2):
+        update2 = rest_client2.get_updates_since(0)
+    assert update2.to_version == update1.to_version
+    assert update2.created == {party2}
+
+    rest_client3 = RegistryRestClient(cache_dir=temp_path)
+    with serve(rest_client3, api2) as http_get:
+        update3 = rest_client3.get_updates_since(0)
+        assert http_get.call_args[0][0]['from_version'] == update2.to_version
+    assert update3.created == {party2}
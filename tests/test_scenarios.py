@@ -104,8 +104,7 @@ def add_rules(
         site_descriptions: Dict[str, Any], clients: Dict[str, Site]) -> None:
     """Add rules to sites using internal API."""
     for site_name, desc in site_descriptions.items():
-        for rule in desc['rules']:
-            clients[site_name].add_rule(rule)
+        clients[site_name].add_rules(desc['rules'])
 
 
 def register_sites(
@@ -0,0 +1,23 @@
+from mahiru.rest.validation import (
+        _cache_file, _load_cached_schemas, _load_schemas,
+        _save_cached_schemas)
+
+
+def test_schema_cache(monkeypatch, temp_path):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(temp_path))
+
+    cache_file = _cache_file('abc')
+    assert cache_file.parent == temp_path / 'mahiru'
+
+    _save_cached_schemas(cache_file, 'abc', {'x': 1})
+    assert _load_cached_schemas(cache_file, 'abc') == {'x': 1}
+    assert _load_cached_schemas(cache_file, 'def') is None
+
+    # unserialisable, should not raise
+    _save_cached_schemas(cache_file, 'abc', {'x': object()})
+    assert _load_cached_schemas(cache_file, 'abc') == {'x': 1}
+
+    schemas = _load_schemas()
+    assert 'Asset' in schemas['components']['schemas']
+    assert len(list((temp_path / 'mahiru').glob('schemas-*.json'))) == 2
+    assert _load_schemas() == schemas